@@ -1,3 +1,4 @@
+import asyncio
 import os
 import ssl
 
@@ -6,6 +7,10 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from routers import file_docs, repos
+from services.clients.anyscale_client import get_anyscale_client
+from services.clients.openai_client import get_openai_client
+from services.data_service import get_data_service
+from services.llm_cache_service import get_llm_cache_service
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -33,6 +38,22 @@ app.add_middleware(
 app.include_router(file_docs.router)
 app.include_router(repos.router)
 
+
+@app.on_event("startup")
+async def warmup_clients():
+    await asyncio.gather(
+        get_openai_client().warmup(n=16),
+        get_data_service().awarmup(),
+    )
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    get_llm_cache_service().log_hit_rate()
+    await get_openai_client().aclose()
+    await get_anyscale_client().aclose()
+
+
 # Initializing Firebase App
 firebase_app = firebase_admin.initialize_app(
     credential=None,
@@ -27,9 +27,9 @@ async def generate_file_docs(
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                             detail="Required field 'github_url' is missing.")
 
-    github_file = github_service.get_file_from_url(request.github_url)
+    github_file = await github_service.aget_file_from_url(request.github_url)
 
-    doc_id = documentation_service.enqueue_generate_file_doc_job(
+    doc_id = await documentation_service.enqueue_generate_file_doc_job(
         user_id,
         background_tasks,
         github_file,
@@ -50,7 +50,7 @@ async def get_file_docs(
 ) -> GetFileDocsResponse:
     user_id = user.get("uid")
 
-    doc = data_service.get_user_documentation(user_id, doc_id)
+    doc = await data_service.aget_user_documentation(user_id, doc_id)
 
     return GetFileDocsResponse(**doc.model_dump())
 
@@ -63,7 +63,7 @@ async def delete_file_docs(
 ) -> DeleteFileDocsResponse:
     user_id = user.get("uid")
 
-    data_service.delete_user_documentation(user_id, doc_id)
+    await data_service.adelete_user_documentation(user_id, doc_id)
 
     return DeleteFileDocsResponse(
         message=f"The data associated with id='{doc_id}' was deleted.",
@@ -81,7 +81,7 @@ async def regenerate_file_docs(
 ) -> UpdateFileDocsResponse:
     user_id = user.get("uid")
     
-    doc_id = documentation_service.regenerate_doc(
+    doc_id = await documentation_service.regenerate_doc(
         background_tasks,
         user_id,
         doc_id,
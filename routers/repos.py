@@ -1,7 +1,7 @@
-import json
-from typing import Dict, Any
+import orjson
+from typing import Dict, Any, Optional
 
-from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException, Response
+from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException, Query, Response
 from fastapi.responses import StreamingResponse
 from starlette import status
 
@@ -37,22 +37,27 @@ router = APIRouter()
 async def get_repos(
     data_service: DataService = Depends(get_data_service),
     user: Dict[str, Any] = Depends(utils.get_user_token),
+    limit: Optional[int] = Query(default=None, gt=0),
+    cursor: Optional[str] = None,
 ) -> GetReposResponse:
     user_id = user.get("uid")
 
-    repos_dicts = data_service.get_user_repos(user_id)
+    repos_dicts = await data_service.aget_user_repos(user_id, limit=limit, cursor=cursor)
     repos = [FirestoreRepo(**repo_dict) for repo_dict in repos_dicts]
     repos_formatted = [
         ReposResponseModel(
             name=repo.repo_name,
             id=repo.id,
             status=repo.status,
-            docs_status=[{doc.id: doc.status} for doc in repo.docs.values()],
+            docs_status={doc_id: doc.status for doc_id, doc in repo.docs.items()},
         )
         for repo in repos
     ]
 
-    return GetReposResponse(repos=repos_formatted)
+    # A full page means there may be more repos after the last one
+    next_cursor = repos_formatted[-1].id if limit and len(repos_formatted) == limit else None
+
+    return GetReposResponse(repos=repos_formatted, next_cursor=next_cursor)
 
 
 @router.get("/repos/{repo_id}")
@@ -63,7 +68,7 @@ async def get_repo(
 ) -> GetRepoResponse:
     user_id = user.get("uid")
 
-    repo_dict = data_service.get_user_repo(user_id, repo_id)
+    repo_dict = await data_service.aget_user_repo(user_id, repo_id)
     repo = FirestoreRepo(**repo_dict)
     repo_formatted = utils.format_repo(repo)
 
@@ -79,8 +84,8 @@ async def delete_repo(
 ) -> DeleteRepoResponse:
     user_id = user.get("uid")
 
-    repo_id = data_service.batch_delete_user_repo(user_id, repo_id)
-    embedding_service.delete_repo(repo_id)
+    repo_id = await data_service.abatch_delete_user_repo(user_id, repo_id)
+    await embedding_service.adelete_repo(repo_id)
 
     return DeleteRepoResponse(
         message=f"The data associated with id='{repo_id}' was deleted.", id=repo_id
@@ -108,7 +113,7 @@ async def chat_sse(
 ):
     async def event_stream():
         async for message in chat_service.chat(repo_id, query, user_id, model):
-            yield f"data: {json.dumps(message)}\n\n"
+            yield b"data: " + orjson.dumps(message) + b"\n\n"
 
     return StreamingResponse(event_stream(), media_type="text/event-stream")
 
@@ -121,7 +126,7 @@ async def get_repo_doc(
     user: Dict[str, Any] = Depends(utils.get_user_token),
 ) -> GetFileDocsResponse:
     user_id = user.get("uid")
-    doc = data_service.get_user_documentation(user_id, doc_id)
+    doc = await data_service.aget_user_documentation(user_id, doc_id)
 
     if doc.repo != repo_id:
         raise HTTPException(
@@ -140,8 +145,8 @@ async def upload_repo(
     user: Dict[str, Any] = Depends(utils.get_user_token),
 ) -> UploadRepoResponse:
     user_id = user.get("uid")
-    github_repo = github_service.get_repo_from_url(request.github_url)
-    firestore_repo = identifier_service.identify(github_repo, user_id)
+    github_repo = await github_service.aget_repo_from_url(request.github_url)
+    firestore_repo = await identifier_service.identify(github_repo, user_id)
 
     return UploadRepoResponse(
         message="Files and folders have been identified for documentation.",
@@ -161,7 +166,7 @@ async def generate_repo_docs(
     model: LlmModelEnum = LlmModelEnum.MIXTRAL,
 ) -> GenerateRepoDocsResponse:
     user_id = user.get("uid")
-    repo_dict = data_service.get_user_repo(user_id, repo_id)
+    repo_dict = await data_service.aget_user_repo(user_id, repo_id)
     repo = FirestoreRepo(**repo_dict)
 
     background_tasks.add_task(
@@ -1,6 +1,6 @@
 import logging
 from typing import Dict, Any
-from collections import deque
+from collections import defaultdict, deque
 
 from fastapi import Depends, HTTPException, Response, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
@@ -34,7 +34,7 @@ def format_repo(repo_response: FirestoreRepo) -> RepoFormatted:
     owner_id: str = repo_response.owner
     repo_status: StatusEnum = repo_response.status
     dependencies: dict[str, str] = repo_response.dependencies
-    docs: list[FirestoreDoc] = list(repo_response.docs.values())
+    docs: dict[str, FirestoreDoc] = repo_response.docs
 
     repo_formatted = RepoFormatted(
         name=repo_name,
@@ -45,17 +45,11 @@ def format_repo(repo_response: FirestoreRepo) -> RepoFormatted:
         status=repo_status
     )
 
-    def find_doc_by_id(doc_list: list[FirestoreDoc], doc_id) -> FirestoreDoc | None:
-        for doc in doc_list:
-            if doc.id == doc_id:
-                return doc
-        return None
-
-    def process_node(parent_id, child_id):
-        parent_data: FirestoreDoc = find_doc_by_id(docs, parent_id)
-        child_data: FirestoreDoc = find_doc_by_id(docs, child_id)
-
-        repo_formatted.insert_node(parent_data, child_data)
+    # parent id to child ids, in dependency order, so the BFS touches each edge once
+    children: defaultdict[str, list[str]] = defaultdict(list)
+    for child, parent in dependencies.items():
+        if parent is not None:
+            children[parent].append(child)
 
     def bfs(root):
         used = set()
@@ -67,9 +61,9 @@ def format_repo(repo_response: FirestoreRepo) -> RepoFormatted:
 
         while queue:
             node = queue.popleft()
-            for child, parent in dependencies.items():
-                if parent == node and child not in used:
-                    process_node(parent, child)
+            for child in children.get(node, ()):
+                if child not in used:
+                    repo_formatted.insert_node(docs[node], docs[child])
                     queue.append(child)
                     used.add(child)
 
@@ -1,9 +1,10 @@
+from dataclasses import dataclass
 from typing import ClassVar, Dict, Any, List, Optional
 
 from openai.types import CompletionUsage
 from pydantic import BaseModel, Field
 from enum import Enum
-import json
+import orjson
 
 
 class LlmProvider(str, Enum):
@@ -104,9 +105,11 @@ class FirestoreQuery(BaseModel):
     value: str
 
 
-class FirestoreBatchOp(BaseModel):
+# Internal to DataService and never validated, so a plain dataclass skips pydantic's per-instance overhead
+@dataclass(slots=True)
+class FirestoreBatchOp:
     type: FirestoreBatchOpType
-    # This should be a DocumentReference, but Pydantic has some issues with it
+    # DocumentReference or AsyncDocumentReference
     reference: Any
     data: Optional[Dict[str, Any]] = None
 
@@ -234,18 +237,8 @@ class RepoFormatted(BaseModel):
             self.tree.append(parent_node)
 
     def __str__(self):
-        data_dict = self
-
-        def custom_encoder(obj):
-            if isinstance(obj, (RepoNode, RepoFormatted)):
-                return obj.model_dump()
-            else:
-                return str(obj)
-
-        # Convert the dictionary to a JSON string
-        json_str = json.dumps(data_dict, indent=2, default=custom_encoder)
-
-        return json_str
+        # model_dump already recurses into the nodes, anything else orjson can't encode falls back to str
+        return orjson.dumps(self.model_dump(), default=str, option=orjson.OPT_INDENT_2).decode()
 
 
 # GET /repos/{repo_id}
@@ -268,11 +261,12 @@ class ReposResponseModel(BaseModel):
     name: str
     id: str
     status: StatusEnum
-    docs_status: List[Dict[str, StatusEnum]]
+    docs_status: Dict[str, StatusEnum]
 
 
 class GetReposResponse(BaseModel):
     repos: List[ReposResponseModel]
+    next_cursor: Optional[str] = None
 
 
 # POST /repos
@@ -71,7 +71,7 @@ class ChatService:
                 print(e)
                 break
         # Use fallback prompt
-        relevant_docs = await self.search(repo_id, query)
+        relevant_docs = await self.search(repo_id, query, user_id)
         chat_history = [{"role": "system", "content": CHATBOT_FALLBACK_SYS_PROMPT}, {"role": "user", "content": f"Question: {query}\n{relevant_docs}"}]
         chat_completion = await self.documentation_service.llm_client.generate_messages(
             model=model,
@@ -123,12 +123,16 @@ class ChatService:
 
     async def search(self, repo_id, input, user_id):
         search_results = await self.search_service.search(repo_id, input)
-        docs = {}
+        scores = {}
         for search_result in search_results:
             doc_id, score = search_result["doc_id"], search_result["score"]
-            if doc_id not in docs and score > 0.6:
-                document = self.data_service.get_user_documentation(user_id, doc_id)
-                docs[doc_id] = Relevant_Doc(score, document.markdown_content, document.relative_path)
+            if doc_id not in scores and score > 0.6:
+                scores[doc_id] = score
+
+        documents = await self.data_service.aget_many_user_documentation(user_id, list(scores))
+        docs = {}
+        for (doc_id, score), document in zip(scores.items(), documents):
+            docs[doc_id] = Relevant_Doc(score, document.markdown_content, document.relative_path)
         
         documentation_summary = []
         documentation = []
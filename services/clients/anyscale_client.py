@@ -1,22 +1,44 @@
-import simplejson as json
 import os
-from typing import Dict, List, Type, Union
+from functools import lru_cache
+from typing import Any, Dict, List, Type, Union
 
+import httpx
+import orjson
 from openai.types.chat import ChatCompletion
 from openai.types import CreateEmbeddingResponse
 from pydantic import BaseModel
 
 from schemas.documentation_generation import LlmJsonResponse
 from services.clients.llm_client import LLMClient
+from services.clients.rate_limiter import RateLimiter
 from openai import AsyncOpenAI
 
 
+# Long-lived so every request reuses pooled TCP/TLS connections to Anyscale,
+# HTTP/2 is negotiated when the endpoint offers it so concurrent requests share connections
+_HTTP_CLIENT = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=100),
+    timeout=httpx.Timeout(600, connect=5),
+    http2=True,
+)
+
+
+@lru_cache(maxsize=None)
+def _json_schema(response_model: Type[BaseModel]) -> Dict[str, Any]:
+    # The schema of a response model never changes, so only build it once per model
+    return response_model.model_json_schema()
+
+
 class AnyscaleClient(LLMClient):
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, rate_limiter: RateLimiter | None = None):
         self.api_key = api_key
         self.base_url = "https://api.endpoints.anyscale.com/v1"
         # Anyscale can use the OpenAI's library to perform operations
-        self.anyscale = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+        self.anyscale = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=_HTTP_CLIENT)
+        self.rate_limiter = rate_limiter
+
+    async def aclose(self) -> None:
+        await self.anyscale.close()
 
     async def generate_text(
             self, model: str,
@@ -25,12 +47,14 @@ class AnyscaleClient(LLMClient):
             temperature: float = 1.0,
             max_tokens: int | None = None
     ) -> ChatCompletion:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+        await self._throttle(messages, max_tokens)
         completion = await self.anyscale.chat.completions.create(
             model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             temperature=temperature,
             max_tokens=max_tokens
         )
@@ -44,6 +68,7 @@ class AnyscaleClient(LLMClient):
             temperature: float = 1.0,
             max_tokens: int | None = None
     ) -> ChatCompletion:
+        await self._throttle(messages, max_tokens)
         completion = await self.anyscale.chat.completions.create(
             model=model,
             messages=messages,
@@ -66,24 +91,26 @@ class AnyscaleClient(LLMClient):
         if max_retries != 1:
             raise NotImplementedError("Anyscale retries not supported yet")
 
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+        await self._throttle(messages, max_tokens)
         completion = await self.anyscale.chat.completions.create(
             model=model,
             response_format={
               "type": "json_object",
-              "schema": response_model.model_json_schema()
+              "schema": _json_schema(response_model)
             },
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             temperature=temperature,
             max_tokens=max_tokens
         )
 
         try:
-            parsed_json = json.loads(completion.choices[0].message.content)
+            parsed_json = orjson.loads(completion.choices[0].message.content)
             content = response_model(**parsed_json)
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             raise ValueError("LLM output not parsable")
 
         llm_json_response = LlmJsonResponse(
@@ -106,9 +133,17 @@ class AnyscaleClient(LLMClient):
             input=input
         )
         return embedding
-    
+
+    async def _throttle(self, messages: List[Dict[str, str]], max_tokens: int | None) -> None:
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(RateLimiter.estimate_tokens(messages, max_tokens))
 
 
+@lru_cache(maxsize=1)
 def get_anyscale_client():
     api_key = os.getenv("ANYSCALE_API_KEY")
-    return AnyscaleClient(api_key)
+    rate_limiter = RateLimiter(
+        requests_per_minute=float(os.getenv("ANYSCALE_REQUESTS_PER_MINUTE", 1800)),
+        tokens_per_minute=float(os.getenv("ANYSCALE_TOKENS_PER_MINUTE", 1000000)),
+    )
+    return AnyscaleClient(api_key, rate_limiter)
@@ -8,6 +8,11 @@ from schemas.documentation_generation import LlmJsonResponse
 
 
 class LLMClient(ABC):
+    @abstractmethod
+    async def aclose(self) -> None:
+        """Abstract method for closing the client's connections on shutdown."""
+        pass
+
     @abstractmethod
     async def generate_text(
             self,
@@ -1,21 +1,118 @@
-import json
+import asyncio
+import hashlib
 import os
-from typing import Dict, List, Type
+import random
+from functools import lru_cache
+from typing import Any, Dict, List, Type
 
+import aiohttp
+import httpx
 import instructor
+import orjson
 from openai.types.chat import ChatCompletion
 from pydantic import BaseModel
 
 from schemas.documentation_generation import LlmJsonResponse
 from services.clients.llm_client import LLMClient
-from openai import AsyncOpenAI
+from services.clients.rate_limiter import RateLimiter
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncOpenAI,
+    AuthenticationError,
+    BadRequestError,
+    ConflictError,
+    InternalServerError,
+    NotFoundError,
+    PermissionDeniedError,
+    RateLimitError,
+    UnprocessableEntityError,
+)
+
+# Shared across clients so concurrent requests reuse pooled TCP/TLS connections
+_HTTP_CLIENT = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=1000, max_keepalive_connections=500, keepalive_expiry=60),
+    timeout=httpx.Timeout(600, connect=5),
+    http2=True,
+)
+_SESSION: aiohttp.ClientSession | None = None
+
+# In-flight text completions, keyed by a hash of the request, so concurrent identical requests
+# share one upstream call. Finished completions are cached by LlmCacheService, not here.
+_IN_FLIGHT_COMPLETIONS: Dict[bytes, asyncio.Future] = {}
+
+# Same retry policy as the SDK, so both transports behave alike
+_MAX_RETRIES = 2
+_RETRYABLE_STATUSES = {408, 409, 429}
+_STATUS_ERRORS: Dict[int, Type[APIStatusError]] = {
+    400: BadRequestError,
+    401: AuthenticationError,
+    403: PermissionDeniedError,
+    404: NotFoundError,
+    409: ConflictError,
+    422: UnprocessableEntityError,
+    429: RateLimitError,
+}
+
+
+def _get_session() -> aiohttp.ClientSession:
+    # aiohttp sessions must be created inside a running event loop, so this is done lazily
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        _SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=0, limit_per_host=500, ttl_dns_cache=300, enable_cleanup_closed=True
+            ),
+            timeout=aiohttp.ClientTimeout(total=600, connect=5),
+        )
+    return _SESSION
+
+
+def _cache_key(*parts: Any) -> bytes:
+    return hashlib.blake2b(orjson.dumps(parts), digest_size=16).digest()
+
+
+def _retry_delay(attempt: int, headers: Any = None) -> float:
+    # Honour the server's Retry-After when it is reasonable, otherwise back off exponentially with jitter
+    if headers is not None:
+        try:
+            if "retry-after-ms" in headers:
+                retry_after = float(headers["retry-after-ms"]) / 1000
+            else:
+                retry_after = float(headers.get("retry-after", ""))
+            if 0 < retry_after <= 60:
+                return retry_after
+        except ValueError:
+            pass
+    return min(0.5 * 2 ** attempt, 8.0) * (1 - 0.25 * random.random())
+
+
+def _status_error(status: int, headers: Any, body: bytes, request: httpx.Request) -> APIStatusError:
+    response = httpx.Response(status, headers=dict(headers), content=body, request=request)
+    try:
+        error_body = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        error_body = None
+    message = f"Error code: {status} - {error_body if error_body is not None else body.decode(errors='replace')}"
+    if status >= 500:
+        return InternalServerError(message, response=response, body=error_body)
+    return _STATUS_ERRORS.get(status, APIStatusError)(message, response=response, body=error_body)
+
+
+def _forget_completion(key: bytes, task: asyncio.Future) -> None:
+    if _IN_FLIGHT_COMPLETIONS.get(key) is task:
+        del _IN_FLIGHT_COMPLETIONS[key]
 
 
 class OpenAIClient(LLMClient):
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, rate_limiter: RateLimiter | None = None):
         self.api_key = api_key
         self.base_url = "https://api.openai.com/v1"
-        self.openai = instructor.patch(AsyncOpenAI(api_key=self.api_key, base_url=self.base_url))
+        self.openai = instructor.patch(
+            AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=_HTTP_CLIENT)
+        )
+        self.rate_limiter = rate_limiter
 
     async def generate_text(
             self,
@@ -25,17 +122,25 @@ class OpenAIClient(LLMClient):
             temperature: float = 1.0,
             max_tokens: int | None = 500
     ) -> ChatCompletion:
-        completion = await self.openai.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
+        key = _cache_key(model, system_prompt, prompt, temperature, max_tokens)
+        task = _IN_FLIGHT_COMPLETIONS.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._create_chat_completion({
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                "temperature": temperature,
+                "max_tokens": max_tokens
+            }))
+            task.add_done_callback(lambda t: _forget_completion(key, t))
+            _IN_FLIGHT_COMPLETIONS[key] = task
+
+        # Shielded so one cancelled caller doesn't cancel the request for everyone sharing it
+        completion = await asyncio.shield(task)
         return completion
-    
+
     async def generate_messages(
             self, 
             model: str,
@@ -43,12 +148,12 @@ class OpenAIClient(LLMClient):
             temperature: float = 1.0,
             max_tokens: int | None = None
     ) -> ChatCompletion:
-        completion = await self.openai.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
+        completion = await self._create_chat_completion({
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        })
 
         return completion
 
@@ -63,21 +168,22 @@ class OpenAIClient(LLMClient):
             max_retries: int = 1,
             max_tokens: int | None = 500,
     ) -> LlmJsonResponse:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+        await self._throttle(messages, max_tokens)
         completion_content = await self.openai.chat.completions.create(
             model=model,
             response_model=response_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             temperature=temperature,
             max_retries=max_retries,
             max_tokens=max_tokens
         )
 
-        raw_response_json = completion_content._raw_response.model_dump_json(indent=2)
-        response_dict = json.loads(raw_response_json)
-        completion = ChatCompletion(**response_dict)
+        # instructor keeps the SDK's parsed ChatCompletion around, no need to round-trip it through JSON
+        completion: ChatCompletion = completion_content._raw_response
 
         llm_json_response = LlmJsonResponse(
             content=completion_content,
@@ -87,7 +193,71 @@ class OpenAIClient(LLMClient):
 
         return llm_json_response
 
+    async def warmup(self, n: int = 16) -> None:
+        """Opens keep-alive connections to the API ahead of time, so the first requests
+        don't pay for the TCP/TLS handshake. Failures are ignored since this is best-effort.
+        """
+        session = _get_session()
+
+        async def open_connection():
+            async with session.head(self.base_url):
+                pass
+
+        await asyncio.gather(
+            _HTTP_CLIENT.head(self.base_url),
+            *[open_connection() for _ in range(n)],
+            return_exceptions=True
+        )
+
+    async def aclose(self) -> None:
+        await self.openai.close()
+        if _SESSION is not None:
+            await _SESSION.close()
+
+    async def _create_chat_completion(self, payload: Dict[str, Any]) -> ChatCompletion:
+        url = f"{self.base_url}/chat/completions"
+        request = httpx.Request("POST", url)
+        for attempt in range(_MAX_RETRIES + 1):
+            retries_left = attempt < _MAX_RETRIES
+            await self._throttle(payload["messages"], payload["max_tokens"])
+            # Plain text completions skip the SDK's httpx transport and go straight through aiohttp,
+            # which holds up much better under high concurrency
+            try:
+                async with _get_session().post(
+                    url,
+                    json=payload,
+                    headers={"Authorization": f"Bearer {self.api_key}"},
+                ) as response:
+                    body = await response.read()
+            except asyncio.TimeoutError as e:
+                if retries_left:
+                    await asyncio.sleep(_retry_delay(attempt))
+                    continue
+                raise APITimeoutError(request=request) from e
+            except aiohttp.ClientError as e:
+                if retries_left:
+                    await asyncio.sleep(_retry_delay(attempt))
+                    continue
+                raise APIConnectionError(request=request) from e
+
+            if response.status < 400:
+                # Validated straight from bytes by pydantic-core, without building an intermediate dict
+                return ChatCompletion.model_validate_json(body)
+            if retries_left and (response.status in _RETRYABLE_STATUSES or response.status >= 500):
+                await asyncio.sleep(_retry_delay(attempt, response.headers))
+                continue
+            raise _status_error(response.status, response.headers, body, request)
+
+    async def _throttle(self, messages: List[Dict[str, str]], max_tokens: int | None) -> None:
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(RateLimiter.estimate_tokens(messages, max_tokens))
+
 
+@lru_cache(maxsize=1)
 def get_openai_client():
     api_key = os.getenv("OPENAI_API_KEY")
-    return OpenAIClient(api_key)
+    rate_limiter = RateLimiter(
+        requests_per_minute=float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 3500)),
+        tokens_per_minute=float(os.getenv("OPENAI_TOKENS_PER_MINUTE", 1000000)),
+    )
+    return OpenAIClient(api_key, rate_limiter)
@@ -1,24 +1,40 @@
 from pinecone import Pinecone
+from pinecone.grpc import PineconeGRPC
+from functools import lru_cache
 from typing import List, Dict, Any, Optional, Union
+import asyncio
 import os
 
 class PineconeClient:
+    # Pinecone recommends upserting in batches of around 100 vectors
+    UPSERT_BATCH_SIZE = 100
+
     def __init__(self, api_key: str, index: str):
         pc = Pinecone(api_key=api_key)
         self.index = pc.Index(index)
+        # Upserts go over gRPC so batches can be sent concurrently on one multiplexed channel
+        self.grpc_index = PineconeGRPC(api_key=api_key).Index(index)
 
-    def upsert(self, vectors: Union[List[tuple], List[dict]], namespace: str):
-        self.index.upsert(vectors=vectors, namespace=namespace)
+    async def upsert(self, vectors: Union[List[tuple], List[dict]], namespace: str):
+        futures = [
+            self.grpc_index.upsert(vectors=vectors[i:i + self.UPSERT_BATCH_SIZE], namespace=namespace, async_req=True)
+            for i in range(0, len(vectors), self.UPSERT_BATCH_SIZE)
+        ]
+        await asyncio.gather(*[asyncio.to_thread(future.result) for future in futures])
     
     def query(self, namespace: str, query_vector: List[float], top_k: int, **kwargs):
-        return self.index.query(namespace=namespace, vector=query_vector, top_k=top_k, **kwargs)
+        # Matches come back as protobuf over gRPC instead of JSON that has to be parsed
+        return self.grpc_index.query(namespace=namespace, vector=query_vector, top_k=top_k, **kwargs)
     
     def delete(self, namespace: str):
         self.index.delete(delete_all=True, namespace=namespace)
     
     def describe(self, filter: Optional[Dict[str, Union[str, float, int, bool, List, dict]]] = None):
         return self.index.describe_index_stats(filter)
-    
+
+
+# One client per process, so every request shares the same gRPC channel instead of opening its own
+@lru_cache(maxsize=1)
 def get_pinecone_client():
     api_key = os.getenv("PINECONE_API_KEY")
     return PineconeClient(api_key, "rocketdocs-repos-1")
\ No newline at end of file
@@ -0,0 +1,52 @@
+import asyncio
+import time
+from typing import Dict, List
+
+
+class RateLimiter:
+    """Token buckets for a provider's requests-per-minute and tokens-per-minute limits.
+    Requests wait here until the budget allows them, instead of hitting 429s and retrying with backoff.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._available_requests = requests_per_minute
+        self._available_tokens = tokens_per_minute
+        self._updated_at = time.monotonic()
+        # asyncio.Lock wakes waiters in FIFO order, so requests are dispatched in arrival order
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def estimate_tokens(messages: List[Dict[str, str]], max_tokens: int | None) -> int:
+        # Assume 4 chars = 1 token for the prompt, and that the completion may use all of max_tokens
+        return sum(len(message["content"]) for message in messages) // 4 + (max_tokens or 0)
+
+    async def acquire(self, tokens: int) -> None:
+        # A request bigger than the whole bucket would wait forever, let it through once the bucket is full
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._available_requests >= 1 and self._available_tokens >= tokens:
+                    self._available_requests -= 1
+                    self._available_tokens -= tokens
+                    return
+
+                missing_requests = max(0.0, 1 - self._available_requests)
+                missing_tokens = max(0.0, tokens - self._available_tokens)
+                await asyncio.sleep(60 * max(
+                    missing_requests / self.requests_per_minute,
+                    missing_tokens / self.tokens_per_minute,
+                ))
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed_minutes = (now - self._updated_at) / 60
+        self._updated_at = now
+        self._available_requests = min(
+            self.requests_per_minute, self._available_requests + elapsed_minutes * self.requests_per_minute
+        )
+        self._available_tokens = min(
+            self.tokens_per_minute, self._available_tokens + elapsed_minutes * self.tokens_per_minute
+        )
@@ -1,35 +1,123 @@
+import asyncio
+import itertools
 import os
-from typing import Generator, Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Generator, Iterator, Any, Dict, List, Optional, Tuple
 
 import firebase_admin
+import orjson
+from cachetools import LRUCache, TTLCache
 from dotenv import load_dotenv
 from fastapi import HTTPException, status
-from firebase_admin import storage, firestore
-from google.cloud.firestore_v1 import DocumentReference, WriteBatch
+from firebase_admin import storage, firestore, firestore_async
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1 import AsyncDocumentReference, DocumentReference, WriteBatch, Increment, ArrayUnion, \
+    transactional, async_transactional
+from google.cloud.firestore_v1.async_client import AsyncClient
 from google.cloud.firestore_v1.base_document import DocumentSnapshot
 from google.cloud.firestore_v1.client import Client
-from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.base_query import BaseQuery, FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
 from google.cloud.storage import Blob
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 
 from schemas.documentation_generation import StatusEnum, FirestoreDoc, FirestoreBatchOp, FirestoreBatchOpType, \
     FirestoreRepo, FirestoreQuery
 
 
+_MISSING = object()
+# Validates a whole batch of docs in one call into pydantic-core instead of one model init per doc
+_DOCS_ADAPTER = TypeAdapter(List[Optional[FirestoreDoc]])
+
+
+def _to_json_bytes(obj) -> bytes:
+    # Firestore sentinels (Increment, DELETE_FIELD, ...) aren't JSON, they are stringified
+    return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+@lru_cache(maxsize=1)
+def _get_clients() -> Tuple[Any, Client, AsyncClient]:
+    # Credential resolution and gRPC channel setup happen once per process
+    return storage.bucket(), firestore.client(), firestore_async.client()
+
+
+# The status checks run inside the transaction, so a doc can't switch to IN_PROGRESS between the check and the delete
+@transactional
+def _delete_in_transaction(transaction, document_ref: DocumentReference, check) -> None:
+    snapshot = document_ref.get(transaction=transaction)
+    check(snapshot if snapshot.exists else None)
+    transaction.delete(document_ref)
+
+
+@async_transactional
+async def _adelete_in_transaction(transaction, document_ref: AsyncDocumentReference, check) -> None:
+    snapshot = await document_ref.get(transaction=transaction)
+    check(snapshot if snapshot.exists else None)
+    transaction.delete(document_ref)
+
+
+@async_transactional
+async def _aupdate_in_transaction(transaction, document_ref: AsyncDocumentReference, data, check) -> DocumentSnapshot:
+    snapshot = await document_ref.get(transaction=transaction)
+    check(snapshot if snapshot.exists else None)
+    transaction.update(document_ref, data)
+    return snapshot
+
+
 class DataService:
     DOCUMENTATION_COLLECTION = "documentation"
     REPO_COLLECTION = "repos"
+    LLM_CACHE_COLLECTION = "llm_cache"
+    # Repo list views only need these fields, the dependency graph can be large
+    REPO_LIST_FIELDS = ["repo_name", "owner", "status", "docs"]
+    # How long a finished read keeps being shared with callers that ask for the same document
+    INFLIGHT_TAIL_SECONDS = 0.05
+    # Snapshots are reused for this long, which mostly absorbs clients polling a doc while it is generated
+    SNAPSHOT_TTL_SECONDS = 2.0
+    # Async writes queued while the previous batch was committing are merged and committed as one batch
+    MAX_COALESCED_WRITES = 500
+    # Firestore rejects commits with more than 500 writes or a payload over 10 MiB
+    MAX_BATCH_OPS = 500
+    MAX_BATCH_BYTES = 9 * 1024 * 1024
+    # Caps how many batch commits share the gRPC channel at once
+    MAX_CONCURRENT_COMMITS = 10
+    # Fields of a doc that are mirrored in its repo's nested docs map
+    REPO_DOC_FIELDS = ["status", "github_url", "id", "relative_path", "type"]
 
     def __init__(self):
-        self.bucket = storage.bucket()
-        self.db: Client = firestore.client()
+        # async_db is used from coroutines so Firestore RPCs don't block the event loop
+        self.bucket, self.db, self.async_db = _get_clients()
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._snapshots: TTLCache = TTLCache(maxsize=4096, ttl=self.SNAPSHOT_TTL_SECONDS)
+        # Bumped to a fresh value on every invalidation, so a read that overlapped a write can tell.
+        # Values are never reused, an evicted key just makes in-progress reads skip the cache.
+        self._generations: LRUCache = LRUCache(maxsize=65536)
+        self._generation_counter = itertools.count(1)
+        self._refs: LRUCache = LRUCache(maxsize=4096)
+        self._async_refs: LRUCache = LRUCache(maxsize=4096)
+        self._write_queue: asyncio.Queue = asyncio.Queue()
+        self._writer_task: asyncio.Task | None = None
+
+    async def awarmup(self) -> None:
+        """Opens the Firestore gRPC channels and the Cloud Storage connection ahead of the first request.
+        Failures are ignored since this is best-effort.
+        """
+        async def read_one():
+            return [doc async for doc in self.async_db.collection(self.REPO_COLLECTION).limit(1).stream()]
+
+        await asyncio.gather(
+            read_one(),
+            asyncio.to_thread(lambda: list(self.db.collection(self.REPO_COLLECTION).limit(1).stream())),
+            asyncio.to_thread(self.bucket.exists),
+            return_exceptions=True
+        )
 
     def get_documentation(self, doc_id) -> FirestoreDoc | None:
         document_snapshot = self._get(self.DOCUMENTATION_COLLECTION, doc_id)
         if not document_snapshot:
             return None
-        document_dict = document_snapshot.to_dict()
-        document_dict["id"] = document_snapshot.id
+        document_dict = self._snapshot_to_dict(document_snapshot)
         firestore_doc = FirestoreDoc(**document_dict)
         return firestore_doc
     
@@ -44,9 +132,52 @@ class DataService:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail=f"{user_id} is not the owner of documentation with id {doc_id}.")
 
-        documentation_dict = {**doc.to_dict(), 'id': doc.id}
+        documentation_dict = self._snapshot_to_dict(doc)
         return FirestoreDoc(**documentation_dict)
 
+    async def aget_documentation(self, doc_id) -> FirestoreDoc | None:
+        document_snapshot = await self._aget(self.DOCUMENTATION_COLLECTION, doc_id)
+        if not document_snapshot:
+            return None
+        document_dict = self._snapshot_to_dict(document_snapshot)
+        return FirestoreDoc(**document_dict)
+
+    async def aget_user_documentation(self, user_id, doc_id) -> FirestoreDoc | None:
+        doc = await self._aget(self.DOCUMENTATION_COLLECTION, doc_id)
+
+        if not doc:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"No documentation found with id {doc_id}.")
+
+        if doc.get('owner') != user_id:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                detail=f"{user_id} is not the owner of documentation with id {doc_id}.")
+
+        documentation_dict = self._snapshot_to_dict(doc)
+        return FirestoreDoc(**documentation_dict)
+
+    async def aget_many_documentation(self, doc_ids: List[str]) -> List[FirestoreDoc | None]:
+        snapshots = await self._aget_many(self.DOCUMENTATION_COLLECTION, doc_ids)
+        return _DOCS_ADAPTER.validate_python([
+            self._snapshot_to_dict(snapshot) if snapshot else None
+            for snapshot in snapshots
+        ])
+
+    async def aget_many_user_documentation(self, user_id, doc_ids: List[str]) -> List[FirestoreDoc]:
+        snapshots = await self._aget_many(self.DOCUMENTATION_COLLECTION, doc_ids)
+        docs = []
+        for doc_id, doc in zip(doc_ids, snapshots):
+            if not doc:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail=f"No documentation found with id {doc_id}.")
+
+            if doc.get('owner') != user_id:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                    detail=f"{user_id} is not the owner of documentation with id {doc_id}.")
+
+            docs.append(self._snapshot_to_dict(doc))
+        return _DOCS_ADAPTER.validate_python(docs)
+
     def add_documentation(self, data) -> str:
         document_ref = self._add(
             self.DOCUMENTATION_COLLECTION,
@@ -57,54 +188,143 @@ class DataService:
 
         return document_ref.id
 
-    def update_documentation(self, doc_id: str, data) -> None:
-        if isinstance(data, BaseModel):
-            data = data.model_dump(exclude_defaults=True)
+    async def aset_documentation(self, doc_id: str, data) -> None:
+        # For docs whose id was generated up front, one write instead of add + id update
+        await self._aset(self.DOCUMENTATION_COLLECTION, doc_id, {**self._to_firestore_dict(data), 'id': doc_id})
+
+    def update_documentation(self, doc_id: str, data, doc: FirestoreDoc | None = None) -> None:
+        """Pass the doc when the caller already has it, it's only read to find the repo to mirror fields into."""
+        data = self._to_firestore_dict(data)
 
         self._update(self.DOCUMENTATION_COLLECTION, doc_id, data)
-        doc = self.get_documentation(doc_id)
+        if not any(key in data for key in self.REPO_DOC_FIELDS):
+            return
+        if doc is None:
+            doc = self.get_documentation(doc_id)
 
         if doc.repo:
-            repo_doc_ref = self.db.collection(self.REPO_COLLECTION).document(doc.repo)
-            repo_doc = repo_doc_ref.get().to_dict()
+            # Update only specific fields in the repo's nested docs. Field paths let Firestore apply them
+            # in place, so the repo isn't read and concurrent doc updates can't overwrite each other.
+            repo_data = {
+                FieldPath("docs", doc_id, key).to_api_repr(): data[key]
+                for key in self.REPO_DOC_FIELDS
+                if key in data
+            }
+            if repo_data:
+                self._update(self.REPO_COLLECTION, doc.repo, repo_data)
+
+    async def aupdate_documentation(self, doc_id: str, data, doc: FirestoreDoc | None = None) -> None:
+        data = self._to_firestore_dict(data)
+
+        writes = [self._aenqueue_write(self.DOCUMENTATION_COLLECTION, doc_id, data)]
+        if doc is None and any(key in data for key in self.REPO_DOC_FIELDS):
+            doc = await self.aget_documentation(doc_id)
+
+        if doc and doc.repo:
+            # Update only specific fields in the repo's nested docs. Field paths avoid reading the repo
+            # and let updates for sibling docs merge into a single repo write.
+            repo_data = {
+                FieldPath("docs", doc_id, key).to_api_repr(): data[key]
+                for key in self.REPO_DOC_FIELDS
+                if key in data
+            }
+            if repo_data:
+                writes.append(self._aenqueue_write(self.REPO_COLLECTION, doc.repo, repo_data))
+
+        await asyncio.gather(*writes)
+
+    async def astart_documentation(self, doc_id: str) -> FirestoreDoc:
+        # Check and status flip in one transaction, so repeated regenerate calls can't start the same doc twice
+        snapshot = await self._aupdate_checked(
+            self.DOCUMENTATION_COLLECTION, doc_id, {"status": StatusEnum.IN_PROGRESS.value},
+            lambda doc: self._check_documentation_startable(doc_id, doc)
+        )
+        return FirestoreDoc(**self._snapshot_to_dict(snapshot))
 
-            # Update only specific fields in the repo's nested docs
-            for key in ["status", "github_url", "id", "relative_path", "type"]:
-                if key in data:
-                    repo_doc["docs"][doc.id][key] = data[key]
+    @staticmethod
+    def _check_documentation_startable(doc_id: str, doc: DocumentSnapshot | None) -> None:
+        if not doc:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"No documentation found with id {doc_id}.")
 
-            repo_doc_ref.update({"docs": repo_doc["docs"]})
+        if doc.get("status") not in [StatusEnum.COMPLETED, StatusEnum.FAILED]:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Data is still being generated for this id, so it cannot be regenerated yet.")
 
     def delete_documentation(self, doc_id: str) -> None:
-        doc = self._get(self.DOCUMENTATION_COLLECTION, doc_id)
-        if doc.get("status") == StatusEnum.IN_PROGRESS:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                                detail=f"Data is still being generated for this id, so it cannot be deleted yet.")
-        self._delete(
-            self.DOCUMENTATION_COLLECTION,
-            doc_id
+        self._delete_checked(self.DOCUMENTATION_COLLECTION, doc_id,
+                             lambda doc: self._check_documentation_deletable(doc_id, doc))
+
+    def batch_delete_documentation(self, doc_ids: List[str], blob_urls: List[str] | None = None) -> List[str]:
+        # One get_all round trip for every status check instead of a _get per document
+        batch_ops = self._delete_documentation_ops(doc_ids, self._get_many(self.DOCUMENTATION_COLLECTION, doc_ids))
+        self._perform_batch(batch_ops)
+
+        if blob_urls:
+            self.bucket.delete_blobs([self.bucket.blob(blob_url) for blob_url in blob_urls], on_error=lambda blob: None)
+
+        return doc_ids
+
+    async def abatch_delete_documentation(self, doc_ids: List[str], blob_urls: List[str] | None = None) -> List[str]:
+        batch_ops = self._delete_documentation_ops(doc_ids, await self._aget_many(self.DOCUMENTATION_COLLECTION, doc_ids))
+
+        # The Firestore batch and the blob deletes don't depend on each other, so they all go out at once
+        await asyncio.gather(
+            self._aperform_batch(batch_ops),
+            *[asyncio.to_thread(self._delete_blob_if_exists, blob_url) for blob_url in blob_urls or []]
         )
 
+        return doc_ids
+
+    def _delete_documentation_ops(self, doc_ids: List[str], docs: List[DocumentSnapshot | None]) -> List[FirestoreBatchOp]:
+        batch_ops = []
+        for doc_id, doc in zip(doc_ids, docs):
+            if not doc:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail=f"No documentation found with id {doc_id}.")
+
+            if doc.get("status") == StatusEnum.IN_PROGRESS:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"Data is still being generated for id {doc_id}, so it cannot be deleted yet.")
+
+            batch_ops.append(
+                FirestoreBatchOp(
+                    type=FirestoreBatchOpType.DELETE,
+                    reference=doc.reference
+                )
+            )
+        return batch_ops
+
     def delete_user_documentation(self, user_id: str, doc_id: str) -> None:
-        doc = self._get(self.DOCUMENTATION_COLLECTION, doc_id)
+        self._delete_checked(self.DOCUMENTATION_COLLECTION, doc_id,
+                             lambda doc: self._check_documentation_deletable(doc_id, doc, user_id))
+
+    async def adelete_user_documentation(self, user_id: str, doc_id: str) -> None:
+        await self._adelete_checked(self.DOCUMENTATION_COLLECTION, doc_id,
+                                    lambda doc: self._check_documentation_deletable(doc_id, doc, user_id))
 
+    @staticmethod
+    def _check_documentation_deletable(doc_id: str, doc: DocumentSnapshot | None, user_id: str | None = None) -> None:
         if not doc:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"No documentation found with id {doc_id}.")
-        
-        if doc.get('owner') != user_id:
+
+        if user_id is not None and doc.get('owner') != user_id:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail=f"{user_id} is not the owner of documentation with id {doc_id}.")
 
         if doc.get("status") == StatusEnum.IN_PROGRESS:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                                 detail=f"Data is still being generated for this id, so it cannot be deleted yet.")
-        self._delete(
-            self.DOCUMENTATION_COLLECTION,
-            doc_id
-        )
 
 
+    async def aget_llm_cache_entry(self, key: str) -> Dict[str, Any] | None:
+        entry = await self._aget(self.LLM_CACHE_COLLECTION, key)
+        return entry.to_dict() if entry else None
+
+    async def aset_llm_cache_entry(self, key: str, data: Dict[str, Any]) -> None:
+        await self._aset(self.LLM_CACHE_COLLECTION, key, data)
+
     def add_repo(self, data) -> str:
         document_ref = self._add(
             self.REPO_COLLECTION,
@@ -113,30 +333,56 @@ class DataService:
         return document_ref.id
 
     def update_repo(self, repo_id: str, data) -> None:
-        if isinstance(data, BaseModel):
-            data = data.model_dump(exclude_defaults=True)
+        data = self._to_firestore_dict(data)
         self._update(self.REPO_COLLECTION, repo_id, data)
 
+    async def aupdate_repo(self, repo_id: str, data) -> None:
+        data = self._to_firestore_dict(data)
+        await self._aupdate(self.REPO_COLLECTION, repo_id, data)
+
     def batch_create_repo(self, repo: FirestoreRepo) -> str:
+        # Dump the whole tree once and reuse the nested doc dicts instead of dumping every doc again
+        repo_dict = self._to_firestore_dict(repo)
         batch_ops = [
             FirestoreBatchOp(
                 type=FirestoreBatchOpType.SET,
                 reference=self.db.collection(self.REPO_COLLECTION).document(repo.id),
-                data=repo.model_dump(exclude_defaults=True)
+                data=repo_dict
             )
         ]
-        for doc in repo.docs.values():
+        for doc_id, doc_dict in repo_dict.get("docs", {}).items():
             batch_ops.append(
                 FirestoreBatchOp(
                     type=FirestoreBatchOpType.SET,
-                    reference=self.db.collection(self.DOCUMENTATION_COLLECTION).document(doc.id),
-                    data=doc.model_dump(exclude_defaults=True)
+                    reference=self.db.collection(self.DOCUMENTATION_COLLECTION).document(doc_id),
+                    data=doc_dict
                 )
             )
         self._perform_batch(batch_ops)
 
         return repo.id
 
+    async def abatch_create_repo(self, repo: FirestoreRepo) -> str:
+        repo_dict = self._to_firestore_dict(repo)
+        batch_ops = [
+            FirestoreBatchOp(
+                type=FirestoreBatchOpType.SET,
+                reference=self.async_db.collection(self.REPO_COLLECTION).document(repo.id),
+                data=repo_dict
+            )
+        ]
+        for doc_id, doc_dict in repo_dict.get("docs", {}).items():
+            batch_ops.append(
+                FirestoreBatchOp(
+                    type=FirestoreBatchOpType.SET,
+                    reference=self.async_db.collection(self.DOCUMENTATION_COLLECTION).document(doc_id),
+                    data=doc_dict
+                )
+            )
+        await self._aperform_batch(batch_ops)
+
+        return repo.id
+
     def batch_delete_user_repo(self, user_id: str, repo_id: str) -> str:
         repo = FirestoreRepo(**self.get_user_repo(user_id, repo_id))
 
@@ -165,15 +411,50 @@ class DataService:
 
         return repo.id
 
+    async def abatch_delete_user_repo(self, user_id: str, repo_id: str) -> str:
+        repo = FirestoreRepo(**await self.aget_user_repo(user_id, repo_id))
+
+        if repo.status == StatusEnum.IN_PROGRESS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Data is still being generated for this repo, so it cannot be deleted yet.")
+
+        batch_ops = []
+
+        for doc in repo.docs.values():
+            batch_ops.append(
+                FirestoreBatchOp(
+                    type=FirestoreBatchOpType.DELETE,
+                    reference=self.async_db.collection(self.DOCUMENTATION_COLLECTION).document(doc.id)
+                )
+            )
+
+        batch_ops.append(
+            FirestoreBatchOp(
+                type=FirestoreBatchOpType.DELETE,
+                reference=self.async_db.collection(self.REPO_COLLECTION).document(repo.id)
+            )
+        )
+
+        await self._aperform_batch(batch_ops)
+
+        return repo.id
+
 
     def get_repo(self, repo_id) -> Dict[str, Any]:
         repo = self._get(self.REPO_COLLECTION, repo_id)
-        return {**repo.to_dict(), 'id': repo.id}
-
-    def get_repos(self) -> List[Dict[str, str]]:
-        repos = self._list(self.REPO_COLLECTION)
-        repos_dicts = [{**repo.to_dict(), 'id': repo.id} for repo in repos]
-        return repos_dicts
+        return self._snapshot_to_dict(repo)
+
+    def get_repos(self, limit: int | None = None, cursor: str | None = None) -> Iterator[Dict[str, Any]]:
+        # Yields repos as Firestore streams them, so the whole collection is never held in memory
+        repos = self._list(self.REPO_COLLECTION, limit=limit, start_after=cursor, fields=self.REPO_LIST_FIELDS)
+        for repo in repos:
+            yield self._snapshot_to_dict(repo)
+
+    def get_repos_paginated(self, page_size: int = 100, cursor: str | None = None) -> Tuple[List[Dict[str, Any]], str | None]:
+        """Returns a page of repos and the cursor for the next page, which is None on the last page."""
+        repos = list(self.get_repos(limit=page_size, cursor=cursor))
+        next_cursor = repos[-1]['id'] if len(repos) == page_size else None
+        return repos, next_cursor
     
     def get_user_repo(self, user_id, repo_id) -> Dict[str, Any]:
         repo = self._get(self.REPO_COLLECTION, repo_id)
@@ -186,71 +467,372 @@ class DataService:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail=f"{user_id} is not the owner of repo with id {repo_id}.")
 
-        return {**repo.to_dict(), 'id': repo.id}
+        return self._snapshot_to_dict(repo)
+
+    async def aget_user_repo(self, user_id, repo_id) -> Dict[str, Any]:
+        repo = await self._aget(self.REPO_COLLECTION, repo_id)
+
+        if not repo:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"No repo found with id {repo_id}.")
+
+        if repo.get('owner') != user_id:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                detail=f"{user_id} is not the owner of repo with id {repo_id}.")
+
+        return self._snapshot_to_dict(repo)
     
-    def get_user_repos(self, user_id) -> List[Dict[str, str]]:
+    def get_user_repos(self, user_id, limit: int | None = None, cursor: str | None = None) -> List[Dict[str, str]]:
         user_repo_query = self._query(self.REPO_COLLECTION, [
             FirestoreQuery(field_path="owner", op_string=FirestoreQuery.OP_STRING_EQUALS, value=user_id), # query for owner
-        ])
-        repos_dicts = [{**repo.to_dict(), 'id': repo.id} for repo in user_repo_query]
+        ], limit=limit, start_after=cursor, fields=self.REPO_LIST_FIELDS)
+        repos_dicts = [self._snapshot_to_dict(repo) for repo in user_repo_query]
+
+        return repos_dicts
+
+    async def aget_user_repos(self, user_id, limit: int | None = None, cursor: str | None = None) -> List[Dict[str, str]]:
+        user_repo_query = await self._aquery(self.REPO_COLLECTION, [
+            FirestoreQuery(field_path="owner", op_string=FirestoreQuery.OP_STRING_EQUALS, value=user_id), # query for owner
+        ], limit=limit, start_after=cursor, fields=self.REPO_LIST_FIELDS)
+        repos_dicts = [self._snapshot_to_dict(repo) for repo in user_repo_query]
 
         return repos_dicts
 
+    def increment_field(self, collection_path, document_id, field: str, by: int = 1) -> None:
+        self._update(collection_path, document_id, {field: Increment(by)})
+
+    async def aincrement_field(self, collection_path, document_id, field: str, by: int = 1) -> None:
+        # Not coalesced, merging two increments of the same field would drop one of them
+        await self._aupdate(collection_path, document_id, {field: Increment(by)})
+
+    def append_to_field(self, collection_path, document_id, field: str, values: List[Any]) -> None:
+        self._update(collection_path, document_id, {field: ArrayUnion(values)})
+
+    async def aappend_to_field(self, collection_path, document_id, field: str, values: List[Any]) -> None:
+        await self._aupdate(collection_path, document_id, {field: ArrayUnion(values)})
+
     def _add(self, collection_path, data) -> DocumentReference:
         collection_ref = self.db.collection(collection_path)
-        if isinstance(data, BaseModel):
-            data = data.model_dump()
+        data = self._to_firestore_dict(data)
         update_time, document_ref = collection_ref.add(data)
         return document_ref
 
     def _perform_batch(self, batch_ops: List[FirestoreBatchOp]) -> None:
-        batches = [batch_ops[item:item + 500] for item in range(0, len(batch_ops), 500)]
-        for batch_data in batches:
-            batch = self.db.batch()
-            for batch_op in batch_data:
-                if batch_op.type == FirestoreBatchOpType.SET:
-                    batch.set(batch_op.reference, batch_op.data)
-                elif batch_op.type == FirestoreBatchOpType.UPDATE:
-                    batch.update(batch_op.reference, batch_op.data)
-                elif batch_op.type == FirestoreBatchOpType.DELETE:
-                    batch.delete(batch_op.reference)
-            batch.commit()
-
-    def _get(self, collection_path, document_id) -> DocumentSnapshot | None:
-        document_ref = self.db.collection(collection_path).document(document_id)
+        batches = [self._fill_batch(self.db.batch(), chunk) for chunk in self._chunk_batch_ops(batch_ops)]
+        self._invalidate_ops(batch_ops)
+        if len(batches) == 1:
+            batches[0].commit()
+        elif batches:
+            # Batches are independent, so commit them in parallel rather than paying one round trip each
+            with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+                list(executor.map(lambda batch: batch.commit(), batches))
+        self._invalidate_ops(batch_ops)
+
+    async def _aperform_batch(self, batch_ops: List[FirestoreBatchOp]) -> None:
+        batches = [self._fill_batch(self.async_db.batch(), chunk) for chunk in self._chunk_batch_ops(batch_ops)]
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_COMMITS)
+
+        async def commit(batch):
+            async with semaphore:
+                await batch.commit()
+
+        # Chunks are independent, so the wall time is the slowest commit rather than the sum of all of them
+        self._invalidate_ops(batch_ops)
+        await asyncio.gather(*[commit(batch) for batch in batches])
+        self._invalidate_ops(batch_ops)
+
+    async def _aenqueue_write(self, collection_path, document_id, data) -> None:
+        """Queues an update for the background writer and waits until it has been committed."""
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._write_coalescer())
+
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((collection_path, document_id, data, future))
+        await future
+
+    async def _write_coalescer(self) -> None:
+        # Exits once the queue is drained, _aenqueue_write starts a new one when needed
+        while not self._write_queue.empty():
+            # Nothing waits for more writes to arrive, a lone write is committed right away.
+            # Writes queued while a commit is in flight are all picked up by the next one.
+            pending = []
+            while len(pending) < self.MAX_COALESCED_WRITES and not self._write_queue.empty():
+                pending.append(self._write_queue.get_nowait())
+
+            try:
+                await self._commit_coalesced(pending)
+            except Exception as e:
+                # Callers must never be left waiting, and the writer keeps serving the rest of the queue
+                for *_, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _commit_coalesced(self, pending: List[Tuple[str, str, Dict[str, Any], asyncio.Future]]) -> None:
+        # Later writes to the same document win, like they would with separate updates
+        merged: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for collection_path, document_id, data, _ in pending:
+            merged.setdefault((collection_path, document_id), {}).update(data)
+
+        batch_ops = [
+            FirestoreBatchOp(
+                type=FirestoreBatchOpType.UPDATE,
+                reference=self._aref(collection_path, document_id),
+                data=data
+            )
+            for (collection_path, document_id), data in merged.items()
+        ]
+        try:
+            await self._aperform_batch(batch_ops)
+            results = [None] * len(batch_ops)
+        except Exception:
+            # The merged writes come from unrelated callers, one bad update (say a doc deleted mid-generation)
+            # must not fail the others, so each document is retried on its own
+            semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_COMMITS)
+
+            async def retry(batch_op: FirestoreBatchOp):
+                async with semaphore:
+                    await self._aperform_batch([batch_op])
+
+            results = await asyncio.gather(*[retry(batch_op) for batch_op in batch_ops], return_exceptions=True)
+
+        outcomes = dict(zip(merged.keys(), results))
+        for collection_path, document_id, _, future in pending:
+            if future.done():
+                continue
+            outcome = outcomes[(collection_path, document_id)]
+            if isinstance(outcome, BaseException):
+                future.set_exception(outcome)
+            else:
+                future.set_result(None)
+
+    @staticmethod
+    def _snapshot_to_dict(snapshot: DocumentSnapshot) -> Dict[str, Any]:
+        # to_dict() already returns a fresh copy, so add the id in place rather than copying it again
+        data = snapshot.to_dict()
+        data['id'] = snapshot.id
+        return data
+
+    @staticmethod
+    def _to_firestore_dict(data) -> Dict[str, Any]:
+        # Every model field defaults to None, so skipping unset and None fields keeps the written data the same
+        # while sparing pydantic the per-field default comparisons. Dicts are passed through untouched.
+        if isinstance(data, BaseModel):
+            return data.model_dump(exclude_unset=True, exclude_none=True)
+        return data
+
+    @classmethod
+    def _chunk_batch_ops(cls, batch_ops: List[FirestoreBatchOp]) -> Generator[List[FirestoreBatchOp], Any, None]:
+        chunk, chunk_bytes = [], 0
+        for batch_op in batch_ops:
+            # The JSON size is a cheap stand-in for the encoded write
+            op_bytes = len(_to_json_bytes(batch_op.data)) if batch_op.data else 0
+            if chunk and (len(chunk) == cls.MAX_BATCH_OPS or chunk_bytes + op_bytes > cls.MAX_BATCH_BYTES):
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(batch_op)
+            chunk_bytes += op_bytes
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _fill_batch(batch, batch_ops: List[FirestoreBatchOp]):
+        for batch_op in batch_ops:
+            if batch_op.type == FirestoreBatchOpType.SET:
+                batch.set(batch_op.reference, batch_op.data)
+            elif batch_op.type == FirestoreBatchOpType.UPDATE:
+                batch.update(batch_op.reference, batch_op.data)
+            elif batch_op.type == FirestoreBatchOpType.DELETE:
+                batch.delete(batch_op.reference)
+        return batch
+
+    def _ref(self, collection_path, document_id) -> DocumentReference:
+        key = (collection_path, document_id)
+        document_ref = self._refs.get(key)
+        if document_ref is None:
+            document_ref = self._refs[key] = self.db.collection(collection_path).document(document_id)
+        return document_ref
+
+    def _aref(self, collection_path, document_id) -> AsyncDocumentReference:
+        key = (collection_path, document_id)
+        document_ref = self._async_refs.get(key)
+        if document_ref is None:
+            document_ref = self._async_refs[key] = self.async_db.collection(collection_path).document(document_id)
+        return document_ref
+
+    def _get(self, collection_path, document_id, source: str = "cache") -> DocumentSnapshot | None:
+        # source="server" skips the snapshot cache, for checks that must see the latest state
+        key = (collection_path, document_id)
+        if source != "server":
+            document_snapshot = self._snapshots.get(key, _MISSING)
+            if document_snapshot is not _MISSING:
+                return document_snapshot
+
+        generation = self._generations.get(key, 0)
+        document_ref = self._ref(collection_path, document_id)
         document_snapshot = document_ref.get()
         if not document_snapshot.exists:
-            return None
+            document_snapshot = None
+        self._store_snapshot(key, generation, document_snapshot)
         return document_snapshot
 
+    async def _aget(self, collection_path, document_id, source: str = "cache") -> DocumentSnapshot | None:
+        key = (collection_path, document_id)
+        if source != "server":
+            document_snapshot = self._snapshots.get(key, _MISSING)
+            if document_snapshot is not _MISSING:
+                return document_snapshot
+
+        # Concurrent reads of the same document share a single RPC
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._aget_snapshot(collection_path, document_id))
+            task.add_done_callback(
+                lambda t: t.get_loop().call_later(self.INFLIGHT_TAIL_SECONDS, self._release_inflight, key, t)
+            )
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    def _get_many(self, collection_path, document_ids: List[str]) -> List[DocumentSnapshot | None]:
+        # One get_all round trip instead of one per document. Results arrive in any order, so map them back by id.
+        if not document_ids:
+            return []
+        references = [self._ref(collection_path, document_id) for document_id in dict.fromkeys(document_ids)]
+        snapshots = {snapshot.id: snapshot for snapshot in self.db.get_all(references) if snapshot.exists}
+        return [snapshots.get(document_id) for document_id in document_ids]
+
+    async def _aget_many(self, collection_path, document_ids: List[str]) -> List[DocumentSnapshot | None]:
+        if not document_ids:
+            return []
+        references = [self._aref(collection_path, document_id) for document_id in dict.fromkeys(document_ids)]
+        snapshots = {snapshot.id: snapshot async for snapshot in self.async_db.get_all(references) if snapshot.exists}
+        return [snapshots.get(document_id) for document_id in document_ids]
+
+    async def _aget_snapshot(self, collection_path, document_id) -> DocumentSnapshot | None:
+        key = (collection_path, document_id)
+        generation = self._generations.get(key, 0)
+        document_ref = self._aref(collection_path, document_id)
+        document_snapshot = await document_ref.get()
+        if not document_snapshot.exists:
+            document_snapshot = None
+        self._store_snapshot(key, generation, document_snapshot)
+        return document_snapshot
+
+    def _store_snapshot(self, key: Tuple[str, str], generation: int, document_snapshot: DocumentSnapshot | None) -> None:
+        # A write since the read started may not be reflected in it. Missing documents aren't cached either,
+        # they're usually about to be created and callers poll them until they exist.
+        if document_snapshot is not None and self._generations.get(key, 0) == generation:
+            self._snapshots[key] = document_snapshot
+
+    def _release_inflight(self, key: Tuple[str, str], task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def _invalidate(self, collection_path, document_id) -> None:
+        # Called before and after a write. Reads already in progress see the new generation and don't cache
+        # what they fetched, reads starting later won't join an RPC that was sent before the write.
+        key = (collection_path, document_id)
+        self._generations[key] = next(self._generation_counter)
+        self._inflight.pop(key, None)
+        self._snapshots.pop(key, None)
+
+    def _invalidate_ops(self, batch_ops: List[FirestoreBatchOp]) -> None:
+        for batch_op in batch_ops:
+            self._invalidate(batch_op.reference.parent.id, batch_op.reference.id)
+
+    async def _aset(self, collection_path, document_id, data) -> None:
+        self._invalidate(collection_path, document_id)
+        document_ref = self._aref(collection_path, document_id)
+        await document_ref.set(data)
+        self._invalidate(collection_path, document_id)
+
     def _update(self, collection_path, document_id, data) -> None:
-        document_ref = self.db.collection(collection_path).document(document_id)
+        self._invalidate(collection_path, document_id)
+        document_ref = self._ref(collection_path, document_id)
         document_ref.update(data)
+        self._invalidate(collection_path, document_id)
+
+    async def _aupdate(self, collection_path, document_id, data) -> None:
+        self._invalidate(collection_path, document_id)
+        document_ref = self._aref(collection_path, document_id)
+        await document_ref.update(data)
+        self._invalidate(collection_path, document_id)
 
     def _delete(self, collection_path, document_id) -> None:
-        document_ref = self.db.collection(collection_path).document(document_id)
+        self._invalidate(collection_path, document_id)
+        document_ref = self._ref(collection_path, document_id)
         document_ref.delete()
+        self._invalidate(collection_path, document_id)
+
+    def _delete_checked(self, collection_path, document_id, check) -> None:
+        self._invalidate(collection_path, document_id)
+        _delete_in_transaction(self.db.transaction(), self._ref(collection_path, document_id), check)
+        self._invalidate(collection_path, document_id)
+
+    async def _adelete_checked(self, collection_path, document_id, check) -> None:
+        self._invalidate(collection_path, document_id)
+        await _adelete_in_transaction(self.async_db.transaction(), self._aref(collection_path, document_id), check)
+        self._invalidate(collection_path, document_id)
+
+    async def _aupdate_checked(self, collection_path, document_id, data, check) -> DocumentSnapshot:
+        self._invalidate(collection_path, document_id)
+        snapshot = await _aupdate_in_transaction(
+            self.async_db.transaction(), self._aref(collection_path, document_id), data, check
+        )
+        self._invalidate(collection_path, document_id)
+        return snapshot
 
-    def _list(self, collection_path) -> Generator[DocumentSnapshot, Any, None]:
-        docs = self.db.collection(collection_path)
+    def _list(self, collection_path, limit=None, start_after=None, fields=None) -> Generator[DocumentSnapshot, Any, None]:
+        collection_ref = self.db.collection(collection_path)
+        docs = self._paginate(collection_ref, collection_ref, limit, start_after, fields)
         return docs.stream()
-    
-    def _query(self, collection_path, queries: list[FirestoreQuery]) -> list[DocumentSnapshot]:
+
+    def _query(self, collection_path, queries: list[FirestoreQuery], limit=None, start_after=None, fields=None) -> list[DocumentSnapshot]:
         collection_ref = self.db.collection(collection_path)
 
         query = collection_ref
         for query_details in queries:
             query = query.where(filter=FieldFilter(**query_details.model_dump()))
+        query = self._paginate(collection_ref, query, limit, start_after, fields)
 
         results = query.get()
 
         return results
 
+    async def _aquery(self, collection_path, queries: list[FirestoreQuery], limit=None, start_after=None, fields=None) -> list[DocumentSnapshot]:
+        collection_ref = self.async_db.collection(collection_path)
+
+        query = collection_ref
+        for query_details in queries:
+            query = query.where(filter=FieldFilter(**query_details.model_dump()))
+        query = self._paginate(collection_ref, query, limit, start_after, fields)
+
+        results = await query.get()
+
+        return results
+
+    @staticmethod
+    def _paginate(collection_ref, query, limit: int | None, start_after: str | None, fields: list[str] | None = None) -> BaseQuery:
+        if fields:
+            query = query.select(fields)
+        # Pages are ordered by document id, so the id of the last document doubles as the cursor
+        if limit is None and start_after is None:
+            return query
+        query = query.order_by(FieldPath.document_id())
+        if start_after:
+            query = query.start_after({FieldPath.document_id(): collection_ref.document(start_after)})
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
 
     # Blob operations are unused for now
-    def add_blob(self, blob_url, data: str):
+    def add_blob(self, blob_url, data: str | bytes | Dict[str, Any] | List[Any]):
         blob = self.bucket.blob(blob_url)
-        blob.upload_from_string(data)
+        if isinstance(data, (str, bytes)):
+            blob.upload_from_string(data)
+        else:
+            # Uploaded as the encoded bytes, no str round trip
+            blob.upload_from_string(_to_json_bytes(data), content_type="application/json")
 
     def get_blob(self, blob_url) -> Blob:
         return self.bucket.get_blob(blob_url)
@@ -258,11 +840,21 @@ class DataService:
     def delete_blob(self, blob_url):
         self.bucket.blob(blob_url).delete()
 
+    def _delete_blob_if_exists(self, blob_url) -> None:
+        # Missing blobs are ignored, like delete_blobs(on_error=...) does in batch_delete_documentation
+        try:
+            self.delete_blob(blob_url)
+        except NotFound:
+            pass
+
     @staticmethod
     def get_blob_url(blob_name, folder="repo") -> str:
         return f"{folder}/{blob_name}"
 
 
+# One DataService for the lifetime of the process. The Firestore clients own gRPC channel pools meant to be
+# shared by concurrent calls, and the read coalescing and write queue only help if every request uses them.
+@lru_cache(maxsize=1)
 def get_data_service() -> DataService:
     return DataService()
 
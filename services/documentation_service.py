@@ -1,14 +1,14 @@
 import asyncio
-import json
 import os
-from typing import Coroutine, List, Any, Dict, Optional
+import uuid
+from functools import lru_cache
+from typing import Awaitable, List, Any, Dict, Optional
 from collections import defaultdict
 
 import firebase_admin
-import marko
-from bs4 import BeautifulSoup
+import orjson
 from github.ContentFile import ContentFile
-from marko.block import Heading
+from markdown_it import MarkdownIt
 from openai.types import CompletionUsage
 from openai.types.chat import ChatCompletion
 
@@ -25,6 +25,7 @@ from schemas.documentation_generation import (
 from services.clients.anyscale_client import get_anyscale_client
 from services.clients.openai_client import get_openai_client
 from services.data_service import DataService, get_data_service
+from services.llm_cache_service import LlmCacheService, get_llm_cache_service
 from services.rag_service.embedding_service import EmbeddingService, get_embedding_service
 from fastapi import BackgroundTasks, HTTPException, status
 from transformers import AutoTokenizer
@@ -35,72 +36,73 @@ from services.clients.llm_client import LLMClient
 from services.github_service import GithubService, get_github_service
 from services._prompts import (
     ONE_SHOT_FILE_SYS_PROMPT,
-    NO_SHOT_FILE_JSON_SYS_PROMPT,
-    NO_SHOT_FOLDER_JSON_SYS_PROMPT,
     ONE_SHOT_FOLDER_SYS_PROMPT,
 )
 
+_MARKDOWN = MarkdownIt("commonmark")
+
+
+@lru_cache(maxsize=1)
+def _get_tokenizer():
+    # Loading it reads and parses the whole vocab, so it's done once per process rather than per service.
+    # The fast (Rust) tokenizer is needed for offset mappings.
+    return AutoTokenizer.from_pretrained("mistralai/Mixtral-8x7B-Instruct-v0.1", use_fast=True)
+
 
 class DocumentationService:
+    IN_PROGRESS_WRITE_DELAY_SECONDS = 2.0
+
     def __init__(
         self,
         llm_client: LLMClient,
         github_service: GithubService,
         data_service: DataService,
         embedding_service: EmbeddingService,
+        llm_cache_service: LlmCacheService,
     ):
         self.llm_client = llm_client
         self.github_service = github_service
         self.data_service = data_service
         self.embedding_service = embedding_service
-        self.tokenizer = AutoTokenizer.from_pretrained("mistralai/Mixtral-8x7B-Instruct-v0.1")
-        self.system_prompt_for_file_json = NO_SHOT_FILE_JSON_SYS_PROMPT
-        self.system_prompt_for_folder_json = NO_SHOT_FOLDER_JSON_SYS_PROMPT
-        self.system_prompt_for_folder_markdown = ONE_SHOT_FOLDER_SYS_PROMPT
-        self.system_prompt_for_file_markdown = ONE_SHOT_FILE_SYS_PROMPT
+        self.llm_cache_service = llm_cache_service
+        self.tokenizer = _get_tokenizer()
 
     async def generate_doc(
-        self, doc_id: str, model: LlmModelEnum, dependencies: Optional[List[str]] = None
+        self,
+        doc_id: str,
+        model: LlmModelEnum,
+        dependencies: Optional[List[str]] = None,
+        github_file: Optional[Awaitable[ContentFile]] = None,
+        use_cache: bool = True,
     ):
         if dependencies is None:
             dependencies = []
 
-        doc = self.data_service.get_documentation(doc_id)
-        dep_docs = [self.data_service.get_documentation(dep) for dep in dependencies]
+        doc, *dep_docs = await self.data_service.aget_many_documentation([doc_id, *dependencies])
         self._validate_doc_and_dependencies(doc, dep_docs)
 
-        self.data_service.update_documentation(
-            doc_id, FirestoreDoc(status=StatusEnum.IN_PROGRESS)
-        )
+        generation = asyncio.ensure_future(self._generate_doc_content(doc, dep_docs, model, github_file, use_cache))
 
         try:
-            if doc.type == FirestoreDocType.FILE:
-                file_content = self.github_service.get_file_from_url(doc.github_url)
-                generated_doc = await self._generate_doc_for_file(file_content, model)
-            elif doc.type == FirestoreDocType.DIRECTORY:
-                if dep_docs:
-                    generated_doc = await self._generate_doc_for_folder(
-                        doc, dep_docs, model
+            # New and regenerated docs are already stored as in progress. Repo docs only get the extra write
+            # if generating takes long enough for anyone to see it, cache hits go straight to completed.
+            if doc.status != StatusEnum.IN_PROGRESS:
+                done, _ = await asyncio.wait({generation}, timeout=self.IN_PROGRESS_WRITE_DELAY_SECONDS)
+                if not done:
+                    await self.data_service.aupdate_documentation(
+                        doc_id, {"status": StatusEnum.IN_PROGRESS.value}, doc
                     )
-                else:
-                    generated_doc = GeneratedDoc(
-                        relative_path=doc.relative_path,
-                        usage=None,
-                        extracted_data={"description": "Folder contains no valid dependencies."},
-                        markdown_content="Folder contains no valid dependencies.",
-                    )
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Doc type not supported",
-                )
+            generated_doc = await generation
         except Exception as e:
-            self.data_service.update_documentation(
-                doc.id, FirestoreDoc(status=StatusEnum.FAILED)
+            # The in progress write can fail while generating is still running, stop it and collect its result
+            generation.cancel()
+            await asyncio.gather(generation, return_exceptions=True)
+            await self.data_service.aupdate_documentation(
+                doc.id, {"status": StatusEnum.FAILED.value}, doc
             )
             raise e
 
-        self.data_service.update_documentation(
+        await self.data_service.aupdate_documentation(
             doc_id,
             FirestoreDoc(
                 extracted_data=generated_doc.extracted_data,
@@ -108,44 +110,70 @@ class DocumentationService:
                 usage=generated_doc.usage,
                 status=StatusEnum.COMPLETED,
             ),
+            doc,
         )
 
-    def generate_file_doc_background_task(
-        self, doc_id: str, model: LlmModelEnum
-    ) -> None:
-        generated_doc = asyncio.run(self.generate_doc(doc_id, model))
-
-        self.data_service.update_documentation(
-            doc_id,
-            FirestoreDoc(
-                extracted_data=generated_doc.extracted_data,
-                markdown_content=generated_doc.markdown_content,
-                usage=generated_doc.usage,
-                status=StatusEnum.COMPLETED,
-            ),
+    async def _generate_doc_content(
+        self,
+        doc: FirestoreDoc,
+        dep_docs: List[FirestoreDoc],
+        model: LlmModelEnum,
+        github_file: Optional[Awaitable[ContentFile]] = None,
+        use_cache: bool = True,
+    ) -> GeneratedDoc:
+        if doc.type == FirestoreDocType.FILE:
+            if github_file is None:
+                github_file = self.github_service.aget_file_from_url(doc.github_url)
+            file_content = await github_file
+            return await self._generate_doc_for_file(file_content, model, doc.owner, doc.repo, use_cache)
+        elif doc.type == FirestoreDocType.DIRECTORY:
+            if dep_docs:
+                return await self._generate_doc_for_folder(doc, dep_docs, model, use_cache)
+            return GeneratedDoc(
+                relative_path=doc.relative_path,
+                usage=None,
+                extracted_data={"description": "Folder contains no valid dependencies."},
+                markdown_content="Folder contains no valid dependencies.",
+            )
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Doc type not supported",
         )
 
+    async def generate_file_doc_background_task(
+        self,
+        doc_id: str,
+        model: LlmModelEnum,
+        new_doc: Optional[FirestoreDoc] = None,
+        use_cache: bool = True,
+    ) -> None:
+        # FastAPI awaits async background tasks on the app's loop, so the shared clients are reused.
+        # New docs are created here rather than in the request, generate_doc stores the result itself.
+        if new_doc:
+            await self.data_service.aset_documentation(doc_id, new_doc)
+        await self.generate_doc(doc_id, model, use_cache=use_cache)
+
     # background tasks for generating the documentation
-    def enqueue_generate_file_doc_job(
+    async def enqueue_generate_file_doc_job(
         self,
         user_id: str,
         background_tasks: BackgroundTasks,
         file: ContentFile,
         model: LlmModelEnum,
     ) -> str:
-        doc_id = self.data_service.add_documentation(
-            FirestoreDoc(
-                github_url=file.html_url,
-                type=file.type,
-                size=file.size,
-                relative_path=file.path,
-                status=StatusEnum.IN_PROGRESS,
-                owner=user_id,
-            )
+        # The id is generated here so the response doesn't wait on a Firestore write
+        doc_id = str(uuid.uuid4())
+        new_doc = FirestoreDoc(
+            github_url=file.html_url,
+            type=file.type,
+            size=file.size,
+            relative_path=file.path,
+            status=StatusEnum.IN_PROGRESS,
+            owner=user_id,
         )
 
         # add task to be done async
-        background_tasks.add_task(self.generate_file_doc_background_task, doc_id, model)
+        background_tasks.add_task(self.generate_file_doc_background_task, doc_id, model, new_doc)
 
         return doc_id
 
@@ -155,7 +183,6 @@ class DocumentationService:
         self._validate_repo(firestore_repo)
 
         dgraph = firestore_repo.dependencies
-        root = firestore_repo.root_doc
 
         children_graph = {parent: [] for parent in dgraph.values()}
         indegree = defaultdict(int, {node: 0 for node in dgraph})
@@ -165,29 +192,84 @@ class DocumentationService:
                 children_graph[parent].append(child)
                 indegree[parent] += 1
 
-        while root in indegree:
-            leaves = [node for node, degree in indegree.items() if degree == 0]
-            tasks = [
-                self.generate_doc(leaf, model, children_graph.get(leaf))
-                for leaf in leaves
-            ]
-
-            results = await self._run_concurrently(tasks, 30)
-            for result in results:
-                if isinstance(result, BaseException):
-                    self.data_service.update_repo(
-                        firestore_repo.id, FirestoreRepo(status=StatusEnum.FAILED)
-                    )
-                    raise result
-
-            for leaf in leaves:
-                parent = dgraph[leaf]
+        # A doc is queued as soon as its last child is done, rather than waiting for its whole level,
+        # so one slow file only holds up its own ancestors
+        ready: asyncio.Queue = asyncio.Queue()
+        leaves = [node for node, degree in indegree.items() if degree == 0]
+        for leaf in leaves:
+            ready.put_nowait(leaf)
+        remaining = len(indegree)
+        errors: List[Exception] = []
+        max_concurrency = 30
+
+        # Files are all queued up front, so their GitHub reads can run ahead of the workers
+        # and overlap with the LLM calls instead of sitting in front of each one
+        repo_docs = firestore_repo.docs or {}
+        file_ids = [
+            leaf for leaf in leaves
+            if leaf in repo_docs and repo_docs[leaf].type == FirestoreDocType.FILE
+        ]
+        prefetched: Dict[str, asyncio.Future] = {}
+        next_prefetch = 0
+
+        def prefetch_files():
+            nonlocal next_prefetch
+            if errors:
+                return
+            while next_prefetch < len(file_ids) and len(prefetched) < 2 * max_concurrency:
+                file_id = file_ids[next_prefetch]
+                prefetched[file_id] = asyncio.ensure_future(
+                    self.github_service.aget_file_from_url(repo_docs[file_id].github_url)
+                )
+                next_prefetch += 1
+
+        def stop_workers():
+            for _ in range(max_concurrency):
+                ready.put_nowait(None)
+
+        async def worker():
+            nonlocal remaining
+            while (node := await ready.get()) is not None:
+                # Every leaf is already queued ahead of the stop sentinels, so stop taking work once a doc failed
+                if errors:
+                    return
+                github_file = prefetched.pop(node, None)
+                prefetch_files()
+                try:
+                    await self.generate_doc(node, model, children_graph.get(node), github_file)
+                except Exception as e:
+                    errors.append(e)
+                    if github_file is not None:
+                        # generate_doc may have failed before awaiting it, let the teardown below collect it
+                        prefetched[node] = github_file
+                    stop_workers()
+                    return
+
+                remaining -= 1
+                parent = dgraph.get(node)
                 if parent:
                     indegree[parent] -= 1
-                indegree.pop(leaf)
+                    if indegree[parent] == 0:
+                        ready.put_nowait(parent)
+                if remaining == 0:
+                    stop_workers()
+
+        prefetch_files()
+        await asyncio.gather(*[worker() for _ in range(max_concurrency)])
+        # Reads nobody is going to use are cancelled, which keeps the ones still queued for a thread from running.
+        # A read already on a thread can't be stopped, it finishes in the background and its result is dropped.
+        # All of them are awaited so a failed one doesn't go unretrieved.
+        for github_file in prefetched.values():
+            github_file.cancel()
+        await asyncio.gather(*prefetched.values(), return_exceptions=True)
+        if errors:
+            await self.data_service.aupdate_repo(
+                firestore_repo.id, {"status": StatusEnum.FAILED.value}
+            )
+            raise errors[0]
 
-        self.data_service.update_repo(
-            firestore_repo.id, FirestoreRepo(status=StatusEnum.COMPLETED)
+        await self.data_service.aupdate_repo(
+            firestore_repo.id, {"status": StatusEnum.COMPLETED.value}
         )
 
     async def generate_repo_docs_and_embed_background_task(
@@ -196,29 +278,30 @@ class DocumentationService:
             model: LlmModelEnum,
             user_id: str,
     ):
-        self.data_service.update_repo(
-            firestore_repo.id, FirestoreRepo(status=StatusEnum.IN_PROGRESS)
+        await self.data_service.aupdate_repo(
+            firestore_repo.id, {"status": StatusEnum.IN_PROGRESS.value}
         )
         await self.generate_repo_docs(firestore_repo, model)
         await self.embedding_service.generate_markdown_embeddings_for_repo(firestore_repo.id, user_id)
 
-    def regenerate_doc(
+    async def regenerate_doc(
         self,
         background_tasks: BackgroundTasks,
         user_id: str,
         doc_id: str,
         model: LlmModelEnum,
     ) -> str:
-        doc = self.data_service.get_documentation(doc_id)
-        if doc.status not in [StatusEnum.COMPLETED, StatusEnum.FAILED]:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Data is still being generated for this id, so it cannot be regenerated yet.",
-            )
+        doc = await self.data_service.astart_documentation(doc_id)
 
-        github_file = self.github_service.get_file_from_url(doc.github_url)
+        try:
+            github_file = await self.github_service.aget_file_from_url(doc.github_url)
+        except Exception as e:
+            await self.data_service.aupdate_documentation(
+                doc_id, {"status": StatusEnum.FAILED.value}, doc
+            )
+            raise e
 
-        self.data_service.update_documentation(
+        await self.data_service.aupdate_documentation(
             doc_id,
             FirestoreDoc(
                 id=doc_id,
@@ -229,43 +312,54 @@ class DocumentationService:
                 relative_path=github_file.path,
                 status=StatusEnum.IN_PROGRESS,
             ),
+            doc,
         )
 
-        background_tasks.add_task(self.generate_file_doc_background_task, doc_id, model)
+        # Regenerating asks for a new completion, the cached one is what the user wants replaced
+        background_tasks.add_task(self.generate_file_doc_background_task, doc_id, model, use_cache=False)
 
         return doc_id
 
     async def _generate_doc_for_file(
-        self, file: ContentFile, model: LlmModelEnum
+        self,
+        file: ContentFile,
+        model: LlmModelEnum,
+        owner: Optional[str] = None,
+        repo_id: Optional[str] = None,
+        use_cache: bool = True,
     ) -> GeneratedDoc:
         if not file or file.type != FirestoreDocType.FILE:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, detail="File cannot be empty"
             )
         
-        file_content = file.decoded_content.decode("utf-8")
-        token_count = len(self.tokenizer.encode(file_content))
+        # Replace undecodable bytes rather than failing the whole doc on one stray non-UTF-8 byte
+        file_content = file.decoded_content.decode("utf-8", errors="replace")
         # 32k token limit
         # ~850 for system prompt
         # 2048 for max input
         # With margin of error, we limit token count to 28k tokens.
-        if token_count > 28000:
-            extra_tokens = token_count - 28000
-            # Assume 4 chars = 1 token
-            estimated_chars = extra_tokens * 4
-            file_content = file_content[:len(file_content) - estimated_chars]
-            while len(self.tokenizer.encode(file_content)) > 28000:
-                # Delete 400 chars ~ 100 tokens
-                file_content = file_content[:len(file_content) - 400]
-            file_content += "\n..."
-        
+        encoding = self.tokenizer(file_content, add_special_tokens=False, return_offsets_mapping=True)
+        if len(encoding["input_ids"]) > 28000:
+            # Encoded once, then cut right where the first token past the limit starts
+            file_content = file_content[:encoding["offset_mapping"][28000][0]] + "\n..."
+
         user_prompt_markdown = f"Document the following code file titled {file.path}\n\n{file_content}"
+
+        # Near-duplicates are only looked for among files of the same repo
+        semantic = None
+        if self.llm_cache_service.semantic_enabled and owner and repo_id:
+            semantic_scope = self.llm_cache_service.make_semantic_scope(
+                owner, repo_id, model.value, ONE_SHOT_FILE_SYS_PROMPT, file.path
+            )
+            semantic = (semantic_scope, file_content)
+
         return await self._generate_doc_with_fallback(
-            model, user_prompt_markdown, self.system_prompt_for_file_markdown, file.path
+            model, user_prompt_markdown, ONE_SHOT_FILE_SYS_PROMPT, file.path, semantic, use_cache
         )
 
     async def _generate_doc_for_folder(
-        self, folder: FirestoreDoc, files: List[FirestoreDoc], model: LlmModelEnum
+        self, folder: FirestoreDoc, files: List[FirestoreDoc], model: LlmModelEnum, use_cache: bool = True
     ) -> GeneratedDoc:
         self._validate_folder_and_files(folder, files)
 
@@ -275,12 +369,13 @@ class DocumentationService:
         return await self._generate_doc_with_fallback(
             model,
             user_prompt_markdown,
-            self.system_prompt_for_folder_markdown,
+            ONE_SHOT_FOLDER_SYS_PROMPT,
             folder.relative_path,
+            use_cache=use_cache,
         )
 
     async def _generate_doc_with_fallback(
-        self, model, user_prompt, system_prompt, path
+        self, model, user_prompt, system_prompt, path, semantic=None, use_cache=True
     ):
         total_usage = {
             "completion_tokens": 0,
@@ -289,14 +384,35 @@ class DocumentationService:
         }
         json_content = None
 
-        markdown_content = await self.llm_client.generate_text(
-            model=model,
-            prompt=user_prompt,
-            system_prompt=system_prompt,
-            temperature=0.4,
-            max_tokens=2048,
-        )
-        total_usage = self._combine_usage(total_usage, markdown_content.usage)
+        # Unchanged files (and folders with unchanged descriptions) reuse the previous completion.
+        # Without use_cache the lookups are skipped, but the new completion still replaces the cached one.
+        cache_key = self.llm_cache_service.make_key(model.value, system_prompt, user_prompt)
+        markdown_content = await self.llm_cache_service.alookup(cache_key) if use_cache else None
+
+        # Near-duplicate files (shared boilerplate, copies across folders) reuse a close match's completion
+        embedding = None
+        if markdown_content is None and semantic is not None and use_cache:
+            semantic_scope, semantic_text = semantic
+            embedding = await self.llm_cache_service.aembed(semantic_text)
+            if embedding is not None:
+                # Retargeted to this file, the match's heading and mentions name the file it was written for
+                markdown_content = self.llm_cache_service.semantic_lookup(semantic_scope, embedding, path)
+
+        # Reused completions cost nothing, their usage is what the original request spent
+        cached = markdown_content is not None
+        if not cached:
+            markdown_content = await self.llm_client.generate_text(
+                model=model,
+                prompt=user_prompt,
+                system_prompt=system_prompt,
+                temperature=0.4,
+                max_tokens=2048,
+            )
+            if markdown_content.choices[0].finish_reason == "stop":
+                await self.llm_cache_service.aupdate(cache_key, markdown_content)
+                if embedding is not None:
+                    self.llm_cache_service.semantic_update(semantic_scope, embedding, path, markdown_content)
+            total_usage = self._combine_usage(total_usage, markdown_content.usage)
         markdown_content = self._validate_llm_markdown_response(markdown_content)
 
         # If we fail to generate JSON, take the description from the Markdown
@@ -331,10 +447,8 @@ class DocumentationService:
     @staticmethod
     def _validate_llm_markdown_response(markdown_completion: ChatCompletion) -> str:
         content = markdown_completion.choices[0].message.content
-        # rough fix for the bug where the first character is a space, seems to be an Anyscale thing
-        if content[0] == " ":
-            return content[1:]
-        return content
+        # Anyscale models tend to start their output with whitespace, markdown never needs it
+        return content.lstrip()
 
     @staticmethod
     def _validate_folder_and_files(
@@ -384,27 +498,11 @@ class DocumentationService:
     @staticmethod
     def _validate_json(json_string: str) -> Dict[str, Any] | None:
         try:
-            parsed_json = json.loads(json_string)
+            parsed_json = orjson.loads(json_string)
             return parsed_json
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             return None
 
-    @staticmethod
-    async def _run_concurrently(
-        coroutines: List[Coroutine], batch_size: Optional[int] = None
-    ) -> tuple[BaseException | Any]:
-        """This method leverages the asyncio library to run Coroutines concurrently.
-        :returns: an ordered tuple with the results of the coroutines, including exceptions
-        """
-        if batch_size:
-            results = []
-            for i in range(0, len(coroutines), batch_size):
-                batch = coroutines[i : i + batch_size]
-                results.extend(await asyncio.gather(*batch, return_exceptions=True))
-            return tuple(results)
-        else:
-            return await asyncio.gather(*coroutines, return_exceptions=True)
-
     @staticmethod
     def _combine_usage(total: Dict[str, int], addition: CompletionUsage):
         total["completion_tokens"] += addition.completion_tokens
@@ -414,20 +512,22 @@ class DocumentationService:
 
     @staticmethod
     def _extract_first_heading_content(markdown_content: str) -> str:
-        parsed = marko.parse(markdown_content)
-        heading_content = []
+        # The plain text of the first section with any prose, usually the one under the title.
+        # Working on tokens skips code blocks and drops inline markup without rendering to HTML.
+        tokens = _MARKDOWN.parse(markdown_content)
+        paragraphs = []
 
-        for child in parsed.children:
-            if isinstance(child, Heading):
-                if not heading_content:  # Skip the first heading
-                    continue
-                else:
-                    break
-            html_output = marko.render(child)
-            text = BeautifulSoup(html_output, "html.parser").get_text()
-            heading_content.append(text)
+        for token, next_token in zip(tokens, tokens[1:]):
+            if token.type == "heading_open" and paragraphs:
+                break
+            if token.type == "paragraph_open":
+                paragraphs.append("".join(
+                    child.content if child.type in ("text", "code_inline") else "\n"
+                    for child in next_token.children
+                    if child.type in ("text", "code_inline", "softbreak", "hardbreak")
+                ))
 
-        return "".join(heading_content)
+        return "\n".join(paragraphs).strip()
 
 
 def get_documentation_service(
@@ -447,7 +547,8 @@ def get_documentation_service(
     github_service = get_github_service()
     data_service = get_data_service()
     embedding_service = get_embedding_service()
-    return DocumentationService(llm_client, github_service, data_service, embedding_service)
+    llm_cache_service = get_llm_cache_service()
+    return DocumentationService(llm_client, github_service, data_service, embedding_service, llm_cache_service)
 
 
 # For manually testing this file
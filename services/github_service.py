@@ -1,10 +1,15 @@
+import asyncio
+import copy
 import os
 import re
 import sys
+import threading
+from functools import lru_cache
 from urllib.parse import urlparse
 
 from typing import Optional, List
 
+from cachetools import LRUCache
 from dotenv import load_dotenv
 from fastapi import HTTPException, status
 from github import Github, Auth
@@ -18,22 +23,49 @@ class GithubService:
             self.auth = None
         else:
             self.auth = Auth.Token(token)
-        self.github = Github(auth=self.auth)
+        # Keeps a pool of connections to the GitHub API open between requests
+        self.github = Github(auth=self.auth, pool_size=20)
+        # Fetched files by url, revalidated with their ETag instead of being downloaded again.
+        # Each entry has its own lock, since revalidating rewrites the cached ContentFile in place.
+        self._file_cache: LRUCache = LRUCache(maxsize=1024)
+        self._file_cache_lock = threading.Lock()
 
     def get_file_from_url(self, github_url: str) -> ContentFile:
+        with self._file_cache_lock:
+            entry: tuple[threading.Lock, ContentFile] | None = self._file_cache.get(github_url)
+        if entry is not None:
+            file_lock, contents = entry
+            with file_lock:
+                # Conditional GET with If-None-Match, a 304 keeps the cached content and doesn't count against the rate limit
+                contents.update()
+                # Callers get their own copy, so a later revalidation can't change a file they're still reading
+                return copy.copy(contents)
+
         owner, repo_name, file_path = self._extract_github_url_info(github_url)
         if not file_path:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                                 detail="Invalid GitHub url")
 
-        repo: Repository = self.github.get_repo(owner + "/" + repo_name)
-        contents: ContentFile = repo.get_contents(file_path)
+        # Only the repo's url is needed to fetch a file, so skip the round trip for its metadata
+        repo: Repository = self.github.get_repo(owner + "/" + repo_name, lazy=True)
+        contents = repo.get_contents(file_path)
+        if isinstance(contents, ContentFile):
+            with self._file_cache_lock:
+                self._file_cache[github_url] = (threading.Lock(), contents)
+            return copy.copy(contents)
         return contents
 
+    async def aget_file_from_url(self, github_url: str) -> ContentFile:
+        # PyGithub is blocking, so run it in a thread to keep concurrent fetches concurrent
+        return await asyncio.to_thread(self.get_file_from_url, github_url)
+
     def get_repo_from_url(self, github_url: str) -> Repository:
         username, repo_name, _ = self._extract_github_url_info(github_url)
         return self.github.get_repo(username + "/" + repo_name)
 
+    async def aget_repo_from_url(self, github_url: str) -> Repository:
+        return await asyncio.to_thread(self.get_repo_from_url, github_url)
+
     @staticmethod
     def get_all_repo_contents(repository: Repository, exclude: Optional[List[str]] = None) -> List[ContentFile]:
         all_content = []
@@ -74,6 +106,7 @@ class GithubService:
         return owner, repository_name, file_path
 
 
+@lru_cache(maxsize=1)
 def get_github_service():
     github_api_key = os.getenv("GITHUB_API_KEY")
     return GithubService(token=github_api_key)
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import uuid
 
@@ -95,7 +96,7 @@ class IdentifierService:
         # self.include_pattern = r".*\.(py|js|ts|go|rb)$"
         self.magika = Magika()
 
-    def identify(self, repository: Repository, user_id: str) -> FirestoreRepo:
+    async def identify(self, repository: Repository, user_id: str) -> FirestoreRepo:
         repo_id = str(uuid.uuid4())
         root = FirestoreDoc(
             id=str(uuid.uuid4()),
@@ -113,9 +114,11 @@ class IdentifierService:
         queue = [root]
         while queue:
             parent = queue.pop(0)
-            contents = repository.get_contents(parent.relative_path)
-            for content in contents:
-                if self._skip_node(content):
+            contents = await asyncio.to_thread(repository.get_contents, parent.relative_path)
+            # Checking a file downloads its content, so check all of a folder's entries in parallel threads
+            skips = await asyncio.gather(*[asyncio.to_thread(self._skip_node, content) for content in contents])
+            for content, skip in zip(contents, skips):
+                if skip:
                     continue
                 firestore_doc = FirestoreDoc(
                     id=str(uuid.uuid4()),
@@ -143,7 +146,7 @@ class IdentifierService:
             docs=docs,
             owner=user_id,
         )
-        self.data_service.batch_create_repo(repo)
+        await self.data_service.abatch_create_repo(repo)
         return repo
 
     def _skip_node(self, node: ContentFile) -> bool:
@@ -192,5 +195,5 @@ if __name__ == "__main__":
     identifier = get_identifier_service()
 
     test_repo = github.get_repo_from_url("https://github.com/ryanata/rocketdocs-frontend")
-    test_repo = identifier.identify(test_repo, "someone")
+    test_repo = asyncio.run(identifier.identify(test_repo, "someone"))
     # print(test_repo)
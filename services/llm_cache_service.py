@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import os
+import posixpath
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+import numpy as np
+from cachetools import TTLCache
+from openai.types.chat import ChatCompletion
+
+from schemas.documentation_generation import EmbeddingModelEnum
+from services.clients.anyscale_client import AnyscaleClient, get_anyscale_client
+from services.data_service import DataService, get_data_service
+
+logger = logging.getLogger(__name__)
+
+_TRAILING_WHITESPACE = re.compile(r"[ \t]+$", re.MULTILINE)
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+class LlmCacheService:
+    """Caches LLM completions by request, in memory and in Firestore so other instances can reuse them."""
+    # Long enough that re-running a repo weeks later still reuses the docs of unchanged files
+    TTL = timedelta(days=30)
+    SEMANTIC_THRESHOLD = 0.95
+    # Roughly the 512 token input limit of the embedding model
+    SEMANTIC_WINDOW_CHARS = 2000
+    SEMANTIC_MAX_WINDOWS = 8
+    SEMANTIC_MAX_ENTRIES = 1024
+
+    def __init__(self, data_service: DataService, embedding_client: AnyscaleClient, semantic_enabled: bool = False):
+        self.data_service = data_service
+        self.embedding_client = embedding_client
+        # Every lookup costs an embedding request to Anyscale, whatever the generating model, so it's opt-in
+        self.semantic_enabled = semantic_enabled
+        self._memory: TTLCache = TTLCache(maxsize=1024, ttl=self.TTL.total_seconds())
+        # Lookups since startup, to see how much the cache actually saves. A near-duplicate hit
+        # is also counted as an exact-match miss, since it's only looked for after one.
+        self.hits = 0
+        self.misses = 0
+        self.semantic_hits = 0
+        # scope to (unit embeddings matrix, (path, completion) pairs), oldest rows first
+        self._semantic: dict[tuple[str, ...], tuple[np.ndarray, list[tuple[str, ChatCompletion]]]] = {}
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, prompt: str) -> str:
+        # Trailing spaces and extra blank lines don't change the docs. Indentation and line breaks can
+        # (Python blocks, YAML nesting, Markdown code), so they stay part of the key.
+        prompt = _TRAILING_WHITESPACE.sub("", prompt.replace("\r\n", "\n"))
+        prompt = _BLANK_LINES.sub("\n\n", prompt).strip()
+        return hashlib.sha256(f"{model}|{system_prompt}|{prompt}".encode()).hexdigest()
+
+    async def alookup(self, key: str) -> ChatCompletion | None:
+        completion = self._memory.get(key)
+        if completion is not None:
+            self.hits += 1
+            return completion
+
+        entry = await self.data_service.aget_llm_cache_entry(key)
+        if entry is None or entry["expires_at"] <= datetime.now(timezone.utc):
+            self.misses += 1
+            return None
+
+        completion = ChatCompletion.model_validate(entry["completion"])
+        self._memory[key] = completion
+        self.hits += 1
+        return completion
+
+    def log_hit_rate(self) -> None:
+        lookups = self.hits + self.misses
+        if lookups:
+            logger.info(
+                "LLM cache: %d/%d exact-match hits (%.1f%%), %d near-duplicate hits, %.1f%% overall",
+                self.hits, lookups, 100 * self.hits / lookups,
+                self.semantic_hits, 100 * (self.hits + self.semantic_hits) / lookups,
+            )
+
+    async def aupdate(self, key: str, completion: ChatCompletion) -> None:
+        self._memory[key] = completion
+        await self.data_service.aset_llm_cache_entry(key, {
+            "completion": completion.model_dump(),
+            # Also usable as a Firestore TTL policy field, so stale entries get cleaned up server-side
+            "expires_at": datetime.now(timezone.utc) + self.TTL,
+        })
+
+    @staticmethod
+    def make_semantic_scope(
+            owner: str, repo_id: str, model: str, system_prompt: str, path: str
+    ) -> tuple[str, ...]:
+        # Matches never cross repos, the reused markdown describes the other file's contents.
+        # Within a repo, only files of the same kind are close enough to share documentation.
+        return owner, repo_id, model, system_prompt, os.path.splitext(path)[1]
+
+    async def aembed(self, text: str) -> np.ndarray | None:
+        """Embeds up to SEMANTIC_MAX_WINDOWS windows spread over the text in one request
+        and returns their normalized mean, or None if the text can't be embedded."""
+        if not text.strip():
+            return None
+
+        step = max(self.SEMANTIC_WINDOW_CHARS, -(-len(text) // self.SEMANTIC_MAX_WINDOWS))
+        windows = [text[i:i + self.SEMANTIC_WINDOW_CHARS] for i in range(0, len(text), step)]
+        try:
+            response = await self.embedding_client.generate_embedding(
+                model=EmbeddingModelEnum.BGE_LARGE,
+                input=windows
+            )
+        except Exception as e:
+            logger.error(e)
+            return None
+
+        vectors = np.array([data.embedding for data in response.data], dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        embedding = vectors.mean(axis=0)
+        return embedding / np.linalg.norm(embedding)
+
+    def semantic_lookup(
+            self, scope: tuple[str, ...], embedding: np.ndarray, path: str
+    ) -> ChatCompletion | None:
+        """Returns the completion of the closest file in scope, retargeted from that file's path to `path`,
+        or None if no file is similar enough."""
+        entry = self._semantic.get(scope)
+        if entry is None:
+            return None
+
+        matrix, completions = entry
+        scores = matrix @ embedding
+        best = int(scores.argmax())
+        if scores[best] < self.SEMANTIC_THRESHOLD:
+            return None
+        self.semantic_hits += 1
+        matched_path, completion = completions[best]
+        if matched_path == path:
+            return completion
+        return self._retarget(completion, matched_path, path)
+
+    def semantic_update(
+            self, scope: tuple[str, ...], embedding: np.ndarray, path: str, completion: ChatCompletion
+    ) -> None:
+        matrix, completions = self._semantic.get(
+            scope, (np.empty((0, embedding.shape[0]), dtype=np.float32), [])
+        )
+        self._semantic[scope] = (
+            np.vstack([matrix, embedding])[-self.SEMANTIC_MAX_ENTRIES:],
+            (completions + [(path, completion)])[-self.SEMANTIC_MAX_ENTRIES:],
+        )
+
+    @staticmethod
+    def _retarget(completion: ChatCompletion, from_path: str, to_path: str) -> ChatCompletion:
+        # The docs start with a heading naming the file and may mention it again, by path or by file name.
+        # Both are replaced in one pass, so a name inside the new path isn't replaced a second time.
+        replacements = {from_path: to_path}
+        from_name, to_name = posixpath.basename(from_path), posixpath.basename(to_path)
+        if from_name and from_name != from_path:
+            replacements.setdefault(from_name, to_name)
+        pattern = re.compile(
+            r"(?<![\w./-])(" + "|".join(map(re.escape, sorted(replacements, key=len, reverse=True))) + r")(?![\w-])"
+        )
+
+        retargeted = completion.model_copy(deep=True)
+        message = retargeted.choices[0].message
+        message.content = pattern.sub(lambda match: replacements[match.group(1)], message.content or "")
+        return retargeted
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache_service() -> LlmCacheService:
+    data_service = get_data_service()
+    embedding_client = get_anyscale_client()
+    semantic_enabled = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+    return LlmCacheService(data_service, embedding_client, semantic_enabled)
@@ -30,23 +30,26 @@ class EmbeddingService:
         self.text_chunker = text_chunker
 
     async def generate_markdown_embeddings_for_repo(self, repo_id: str, user_id: str):
-        namespaces = self.vector_database_client.describe()["namespaces"]
+        namespaces = (await asyncio.to_thread(self.vector_database_client.describe))["namespaces"]
         if (repo_id in namespaces):
             # self.vector_database_client.delete(repo_id)
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Repo already exists in the database, we're not going to re-embed it.")
-        repo_dict = self.data_service.get_user_repo(user_id, repo_id)
+        repo_dict = await self.data_service.aget_user_repo(user_id, repo_id)
         repo = FirestoreRepo(**repo_dict)
         repo_formatted = utils.format_repo(repo)
 
+        doc_ids = []
         q = deque(repo_formatted.tree)
         while q:
             node = q.popleft()
-            doc = self.data_service.get_user_documentation(user_id, node.id)
-            await self.generate_markdown_embeddings_for_doc(doc, repo_id)
+            doc_ids.append(node.id)
 
             for child in node.children:
                 if child.completion_status == StatusEnum.COMPLETED:
                     q.append(child)
+
+        for doc in await self.data_service.aget_many_user_documentation(user_id, doc_ids):
+            await self.generate_markdown_embeddings_for_doc(doc, repo_id)
     
     async def generate_markdown_embeddings_for_doc(self, doc: FirestoreDoc, repo_id: str):
         markdown = doc.markdown_content
@@ -81,10 +84,9 @@ class EmbeddingService:
                 input=list_of_chunks
             )
             # The embeddings.data can have up to 2048 embeddings, upserting individually is slow
-            # Pinecone has a limit of 100 upserts per request, so we will "group" the vectors into groups of 100
+            # The Pinecone client splits them into requests of 100 vectors and sends those concurrently
             vectors = []
-            n = len(embeddings.data)
-            for i, embedding in enumerate(embeddings.data):
+            for embedding in embeddings.data:
                 vectors.append({
                     "id": doc.id + f"-{chunk_index}",
                     "values": embedding.embedding,
@@ -93,16 +95,18 @@ class EmbeddingService:
                         "doc_id": doc.id,
                     }
                 })
-                if len(vectors) == 100 or i == n - 1:
-                    self.vector_database_client.upsert(vectors, repo_id)
-                    vectors = []
                 chunk_index += 1
+            await self.vector_database_client.upsert(vectors, repo_id)
     
     def delete_repo(self, repo_id: str):
         try:
             self.vector_database_client.delete(repo_id)
         except NotFoundException:
             print(f"Can't delete repo with id '{repo_id}' because it never existed in Pinecone DB.")
+
+    async def adelete_repo(self, repo_id: str):
+        # The Pinecone REST client is blocking
+        await asyncio.to_thread(self.delete_repo, repo_id)
                 
 def get_embedding_service():
     embedding_client = get_anyscale_client()
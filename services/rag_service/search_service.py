@@ -1,3 +1,5 @@
+import asyncio
+
 from services.data_service import DataService, get_data_service
 from services.clients.pinecone_client import PineconeClient, get_pinecone_client
 from services.clients.anyscale_client import AnyscaleClient, get_anyscale_client
@@ -22,8 +24,9 @@ class SearchService:
             model=EmbeddingModelEnum.BGE_LARGE, input=query
         )
 
-        # 2. Query the vector database
-        results = self.vector_database_client.query(
+        # 2. Query the vector database (the Pinecone client is blocking, so keep it off the event loop)
+        results = await asyncio.to_thread(
+            self.vector_database_client.query,
             namespace=repo_id, query_vector=query_embedding.data[0].embedding, top_k=top_k, include_metadata=True
         )
 
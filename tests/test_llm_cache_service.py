@@ -0,0 +1,61 @@
+import numpy as np
+from openai.types.chat import ChatCompletion
+
+from services.llm_cache_service import LlmCacheService
+
+
+def make_completion(content: str) -> ChatCompletion:
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-3.5-turbo",
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content},
+        }],
+        "usage": {"completion_tokens": 10, "prompt_tokens": 20, "total_tokens": 30},
+    })
+
+
+def test_semantic_hit_is_retargeted_to_the_requested_file():
+    cache = LlmCacheService(data_service=None, embedding_client=None, semantic_enabled=True)
+    scope = cache.make_semantic_scope("owner", "repo", "model", "system", "src/api/users.py")
+    embedding = np.array([1.0, 0.0], dtype=np.float32)
+    near_duplicate = np.array([0.999, 0.04], dtype=np.float32)
+    near_duplicate /= np.linalg.norm(near_duplicate)
+
+    stored = make_completion(
+        "# src/api/users.py\n\n## Request Handlers\n\n`users.py` registers the routes in src/api/users.py.\n"
+    )
+    cache.semantic_update(scope, embedding, "src/api/users.py", stored)
+
+    completion = cache.semantic_lookup(scope, near_duplicate, "src/api/orders.py")
+
+    content = completion.choices[0].message.content
+    assert content.startswith("# src/api/orders.py\n")
+    assert "`orders.py` registers the routes in src/api/orders.py." in content
+    assert "users.py" not in content
+    # The stored completion still describes the file it was generated for
+    assert stored.choices[0].message.content.startswith("# src/api/users.py\n")
+
+
+def test_semantic_hit_for_the_same_file_is_returned_as_is():
+    cache = LlmCacheService(data_service=None, embedding_client=None, semantic_enabled=True)
+    scope = cache.make_semantic_scope("owner", "repo", "model", "system", "src/api/users.py")
+    embedding = np.array([1.0, 0.0], dtype=np.float32)
+    stored = make_completion("# src/api/users.py\n\nRoutes.\n")
+    cache.semantic_update(scope, embedding, "src/api/users.py", stored)
+
+    assert cache.semantic_lookup(scope, embedding, "src/api/users.py") is stored
+
+
+def test_dissimilar_file_is_not_reused():
+    cache = LlmCacheService(data_service=None, embedding_client=None, semantic_enabled=True)
+    scope = cache.make_semantic_scope("owner", "repo", "model", "system", "src/api/users.py")
+    cache.semantic_update(
+        scope, np.array([1.0, 0.0], dtype=np.float32), "src/api/users.py", make_completion("# src/api/users.py\n")
+    )
+
+    assert cache.semantic_lookup(scope, np.array([0.0, 1.0], dtype=np.float32), "src/api/orders.py") is None